@@ -137,7 +137,9 @@ class LinkedPaperList(Resource):
         subject_area = linked_paper_data.get("subject_area")
         from_year = linked_paper_data.get("from_year")
         to_year = linked_paper_data.get("to_year")
-        response = rs_app.search_papers(text, subject_area, from_year, to_year)
+        model_name = linked_paper_data.get("model_name")
+        response = rs_app.search_papers(
+            text, subject_area, from_year, to_year, model_name)
         return handle_response(response)
 
     def post(self):
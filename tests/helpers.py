@@ -0,0 +1,15 @@
+import numpy as np
+
+
+def get_vectors(n, dim, seed=0, centers=50, noise=0.5):
+    # vetores normalizados, agrupados em torno de `centers` centros
+    rng = np.random.default_rng(seed)
+    points = rng.normal(size=(centers, dim))
+    vectors = points[rng.integers(0, centers, n)]
+    vectors = vectors + noise * rng.normal(size=(n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(
+        np.float32)
+
+
+def paper_id(i):
+    return "%024x" % i
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from xlingual_papers_recommender.core.batching import EncodeBatcher
+
+
+class FakeModel:
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, sentences):
+        self.calls.append(list(sentences))
+        return np.array([[len(sentence)] for sentence in sentences])
+
+
+def _encode_concurrently(batcher, requests):
+    results = [None] * len(requests)
+
+    def run(i):
+        results[i] = batcher.encode(requests[i])
+
+    threads = [
+        threading.Thread(target=run, args=(i, ))
+        for i in range(len(requests))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_flush_on_size():
+    model = FakeModel()
+    # espera longa: o lote é processado por atingir o tamanho máximo
+    batcher = EncodeBatcher(model.encode, max_batch_size=4, max_wait_ms=10000)
+    start = time.monotonic()
+    results = _encode_concurrently(
+        batcher, [["a", "bb"], ["ccc", "dddd"]])
+    assert time.monotonic() - start < 5
+    assert [list(result[:, 0]) for result in results] == [[1, 2], [3, 4]]
+    assert sorted(len(call) for call in model.calls) == [4]
+
+
+def test_flush_on_timeout():
+    model = FakeModel()
+    batcher = EncodeBatcher(model.encode, max_batch_size=100, max_wait_ms=50)
+    start = time.monotonic()
+    result = batcher.encode(["a", "bb", "ccc"])
+    elapsed = time.monotonic() - start
+    assert list(result[:, 0]) == [1, 2, 3]
+    assert model.calls == [["a", "bb", "ccc"]]
+    # esperou outras chamadas até o prazo
+    assert 0.04 <= elapsed < 5
+
+
+def test_each_caller_gets_its_own_vectors():
+    model = FakeModel()
+    batcher = EncodeBatcher(model.encode, max_batch_size=1000, max_wait_ms=200)
+    requests = [["x" * (i + 1)] * (i + 1) for i in range(8)]
+    results = _encode_concurrently(batcher, requests)
+    for i, result in enumerate(results):
+        assert list(result[:, 0]) == [i + 1] * (i + 1)
+    assert sum(len(call) for call in model.calls) == 36
+
+
+def test_errors_are_raised_to_the_callers():
+    def encode(sentences):
+        raise RuntimeError("model error")
+
+    batcher = EncodeBatcher(encode, max_batch_size=4, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        batcher.encode(["a"])
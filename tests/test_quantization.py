@@ -0,0 +1,67 @@
+import numpy as np
+
+from xlingual_papers_recommender.core import quantization
+
+from helpers import get_vectors
+
+
+def _get_vectors(n=2000):
+    return get_vectors(n, 64, centers=50, noise=0.5)
+
+
+def test_quantize_float16_round_trip():
+    vectors = _get_vectors()
+    values, scales = quantization.quantize(vectors, "float16")
+    assert values.dtype == np.float16
+    assert scales is None
+    restored = quantization.dequantize(values, scales)
+    assert restored.dtype == np.float32
+    assert np.abs(restored - vectors).max() < 1e-3
+
+
+def test_quantize_int8_round_trip():
+    vectors = _get_vectors()
+    values, scales = quantization.quantize(vectors, "int8")
+    assert values.dtype == np.int8
+    assert scales.shape == (len(vectors), )
+    restored = quantization.dequantize(values, scales)
+    # erro de arredondamento de, no máximo, meia escala por valor
+    assert (np.abs(restored - vectors) <= scales[:, np.newaxis] / 2 + 1e-6).all()
+
+
+def test_quantize_int8_zero_vector():
+    values, scales = quantization.quantize(np.zeros((1, 4)), "int8")
+    assert not values.any()
+    assert scales[0] == 1
+
+
+def test_dot_scores_of_compact_vectors():
+    vectors = _get_vectors(n=100)
+    for dtype in quantization.DTYPES:
+        values, scales = quantization.quantize(vectors, dtype)
+        scores = quantization.dot_scores(vectors[0], values, scales)
+        np.testing.assert_allclose(scores, vectors @ vectors[0], atol=0.02)
+
+
+def test_recall_at_k():
+    vectors = _get_vectors()
+    assert quantization.recall_at_k(vectors, "float32", 10, 50) == 1
+    assert quantization.recall_at_k(vectors, "float16", 10, 50) >= 0.98
+    assert quantization.recall_at_k(vectors, "int8", 10, 50) >= 0.9
+
+
+def test_top_k():
+    scores = np.array([0.1, 0.9, 0.5, 0.7], dtype=np.float32)
+    assert list(quantization.top_k(scores, 2)) == [1, 3]
+    assert list(quantization.top_k(scores, 10)) == [1, 3, 2, 0]
+    assert not len(quantization.top_k(scores, 0))
+
+
+def test_running_top_k():
+    ranking = quantization.RunningTopK(k=3, min_score=0.2)
+    ranking.push(np.array([0.1, 0.9, 0.5]), ["a", "b", "c"])
+    ranking.push(np.array([0.7, 0.3, 0.95]), ["d", "e", "f"])
+    results = ranking.results()
+    assert [item for item, score in results] == ["f", "b", "d"]
+    np.testing.assert_allclose([score for item, score in results], [0.95, 0.9, 0.7])
+    assert len(ranking) == 3
@@ -0,0 +1,71 @@
+from xlingual_papers_recommender.db.data_models import get_source_fingerprint
+
+
+def _fingerprint(doi=None, pub_year="2010", surname="Silva",
+                 organization_author=None, journal="Rev Saude Publica",
+                 source=None, vol="44"):
+    return get_source_fingerprint(
+        doi, pub_year, surname, organization_author, journal, source, vol)
+
+
+def test_doi_fingerprint_ignores_case_and_resolver_prefix():
+    expected = _fingerprint(doi="10.1590/S0034-89102010000100001")
+    assert expected == "DOI:10.1590/S0034-89102010000100001"
+    for doi in (
+            "10.1590/s0034-89102010000100001",
+            " https://doi.org/10.1590/S0034-89102010000100001 ",
+            "http://dx.doi.org/10.1590/s0034-89102010000100001",
+            "doi:10.1590/S0034-89102010000100001"):
+        assert _fingerprint(doi=doi) == expected
+
+
+def test_doi_fingerprint_does_not_depend_on_the_other_data():
+    assert (
+        _fingerprint(doi="10.1590/abc", surname="Silva", vol="1") ==
+        _fingerprint(doi="10.1590/abc", surname="Souza", vol="2")
+    )
+
+
+def test_different_dois_do_not_collide():
+    assert _fingerprint(doi="10.1590/abc") != _fingerprint(doi="10.1590/abd")
+
+
+def test_fingerprint_ignores_accents_case_and_punctuation():
+    assert (
+        _fingerprint(surname="Conceição", journal="Rev. Saúde Pública") ==
+        _fingerprint(surname="CONCEICAO", journal="rev saude publica")
+    )
+
+
+def test_fingerprint_uses_organization_author_and_source_as_fallback():
+    assert (
+        _fingerprint(surname=None, organization_author="WHO",
+                     journal=None, source="World report") ==
+        _fingerprint(surname=None, organization_author="W.H.O.",
+                     journal=None, source="WORLD REPORT")
+    )
+
+
+def test_fingerprints_of_different_references_do_not_collide():
+    fingerprints = {
+        _fingerprint(),
+        _fingerprint(pub_year="2011"),
+        _fingerprint(surname="Souza"),
+        _fingerprint(journal="Cad Saude Publica"),
+        _fingerprint(vol="45"),
+        _fingerprint(vol=None),
+    }
+    assert len(fingerprints) == 6
+    assert all(item.startswith("REF:") for item in fingerprints)
+
+
+def test_reference_fingerprint_differs_from_doi_fingerprint():
+    assert _fingerprint() != _fingerprint(doi="10.1590/abc")
+
+
+def test_fingerprint_requires_year_author_and_title_without_doi():
+    assert _fingerprint(pub_year=None) is None
+    assert _fingerprint(pub_year="s.d.") is None
+    assert _fingerprint(surname=None) is None
+    assert _fingerprint(journal=None) is None
+    assert _fingerprint(surname="...") is None
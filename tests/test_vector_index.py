@@ -0,0 +1,98 @@
+import numpy as np
+
+from xlingual_papers_recommender.core import quantization
+from xlingual_papers_recommender.core.vector_index import (
+    IVFFlatIndex,
+    IVFFlatFile,
+)
+
+from helpers import get_vectors, paper_id
+
+
+def _get_vectors(n=3000):
+    return get_vectors(n, 32, centers=60, noise=0.3)
+
+
+def _get_index(vectors, nlist=None, dtype="float32"):
+    index = IVFFlatIndex(vectors.shape[1], dtype=dtype)
+    for i, vector in enumerate(vectors):
+        index.add(paper_id(i), vector, 2000 + i % 20, ["A" if i % 2 else "B"])
+    if nlist:
+        index.train(nlist)
+    return index
+
+
+def _recall(index, vectors, k=10, nprobe=None, n_queries=50):
+    found = 0
+    for i in range(n_queries):
+        expected = {
+            paper_id(p)
+            for p in quantization.top_k(vectors @ vectors[i], k)
+        }
+        got = {
+            item["paper_id"]
+            for item in index.search(vectors[i], k, nprobe=nprobe)
+        }
+        found += len(expected & got)
+    return found / (k * n_queries)
+
+
+def test_search_without_centroids_is_exact():
+    vectors = _get_vectors(n=500)
+    assert _recall(_get_index(vectors), vectors) == 1
+
+
+def test_ivf_recall_against_brute_force():
+    vectors = _get_vectors()
+    index = _get_index(vectors, nlist=40)
+    assert len(index.centroids) == 40
+    assert _recall(index, vectors, nprobe=8) >= 0.9
+    assert _recall(index, vectors, nprobe=40) == 1
+
+
+def test_ivf_recall_int8():
+    vectors = _get_vectors()
+    index = _get_index(vectors, nlist=40, dtype="int8")
+    assert _recall(index, vectors, nprobe=8) >= 0.85
+
+
+def test_search_filters():
+    vectors = _get_vectors(n=500)
+    index = _get_index(vectors)
+    items = index.search(vectors[0], 20, ["A"], 2005, 2010)
+    assert items
+    for item in items:
+        i = int(item["paper_id"], 16)
+        assert i % 2 == 1
+        assert 2005 <= 2000 + i % 20 <= 2010
+
+
+def test_add_replaces_the_previous_vector():
+    vectors = _get_vectors(n=100)
+    index = _get_index(vectors)
+    index.add(paper_id(0), vectors[1], 2000, ["B"])
+    assert len(index) == 100
+    items = index.search(vectors[1], 2)
+    assert {item["paper_id"] for item in items} == {paper_id(0), paper_id(1)}
+
+
+def test_saved_index_gives_the_same_results(tmp_path):
+    vectors = _get_vectors()
+    index = _get_index(vectors, nlist=40)
+    index.add(paper_id(0), vectors[1], 2000, ["B"])
+    index.save(str(tmp_path), since=10)
+
+    index_file = IVFFlatFile(str(tmp_path))
+    assert len(index_file) == len(index)
+    assert index_file.since == 10
+    for i in range(20):
+        expected = index.search(vectors[i], 10, ["A"], 2003, nprobe=8)
+        got = index_file.search(vectors[i], 10, ["A"], 2003, nprobe=8)
+        assert [item["paper_id"] for item in got] == [
+            item["paper_id"] for item in expected]
+        np.testing.assert_allclose(
+            [item["score"] for item in got],
+            [item["score"] for item in expected], rtol=1e-5)
+    items = index_file.search(vectors[1], 2, exclude={paper_id(0)})
+    assert paper_id(0) not in [item["paper_id"] for item in items]
+    assert items[0]["paper_id"] == paper_id(1)
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from xlingual_papers_recommender.utils import vectors_file
+from xlingual_papers_recommender.utils.vectors_file import VectorsFile
+
+from helpers import paper_id
+
+
+def test_append_and_get(tmp_path):
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    file = VectorsFile(str(tmp_path))
+    file.append([paper_id(i) for i in range(3)], ["h0", "h1", "h2"], vectors)
+
+    items = file.get([paper_id(1), paper_id(2), paper_id(9)])
+    assert set(items) == {paper_id(1), paper_id(2)}
+    text_hash, vector, scale = items[paper_id(1)]
+    assert text_hash == "h1"
+    np.testing.assert_array_equal(vector, vectors[1])
+    assert scale is None
+    assert len(file) == 3
+
+
+def test_reopen(tmp_path):
+    vectors = np.ones((2, 3), dtype=np.float32)
+    VectorsFile(str(tmp_path)).append(
+        [paper_id(1), paper_id(2)], ["h1", "h2"], vectors)
+
+    # o arquivo existente define o formato
+    file = VectorsFile(str(tmp_path), "int8")
+    assert file.dtype == np.float32
+    assert file.dim == 3
+    assert file.get([paper_id(2)])[paper_id(2)][0] == "h2"
+
+
+def test_vectors_appended_by_other_process_are_visible(tmp_path):
+    reader = VectorsFile(str(tmp_path))
+    assert reader.get([paper_id(1)]) == {}
+
+    writer = VectorsFile(str(tmp_path))
+    writer.append([paper_id(1)], ["h1"], np.ones((1, 3), dtype=np.float32))
+    assert reader.get([paper_id(1)])[paper_id(1)][0] == "h1"
+
+
+def test_last_vector_of_an_id_prevails_and_hash_mismatch_is_visible(tmp_path):
+    file = VectorsFile(str(tmp_path))
+    file.append([paper_id(1)], ["old"], np.zeros((1, 3), dtype=np.float32))
+    file.append([paper_id(1)], ["new"], np.ones((1, 3), dtype=np.float32))
+
+    text_hash, vector, scale = file.get([paper_id(1)])[paper_id(1)]
+    # o chamador compara o hash armazenado com o hash do texto atual
+    assert text_hash == "new"
+    assert text_hash != "old"
+    np.testing.assert_array_equal(vector, np.ones(3))
+    assert [item[:2] for item in file.items()] == [(paper_id(1), "new")]
+    # as linhas substituídas continuam no arquivo
+    assert len(file) == 2
+
+
+def test_int8_scales(tmp_path):
+    file = VectorsFile(str(tmp_path), "int8")
+    file.append(
+        [paper_id(1)], ["h1"], np.array([[1, -2, 3]], dtype=np.int8),
+        np.array([0.5], dtype=np.float32),
+    )
+    text_hash, vector, scale = VectorsFile(str(tmp_path)).get(
+        [paper_id(1)])[paper_id(1)]
+    np.testing.assert_array_equal(vector, [1, -2, 3])
+    assert scale == 0.5
+
+
+def test_int8_requires_scales(tmp_path):
+    file = VectorsFile(str(tmp_path), "int8")
+    with pytest.raises(ValueError):
+        file.append(
+            [paper_id(1)], ["h1"], np.array([[1, -2, 3]], dtype=np.int8))
+    assert len(file) == 0
+
+
+def test_sorted_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(vectors_file, "MAX_UNSORTED_ROWS", 5)
+    rng = np.random.default_rng(0)
+    file = VectorsFile(str(tmp_path))
+    expected = {}
+    for step in range(6):
+        ids = [paper_id(i) for i in rng.integers(0, 20, 4)]
+        hashes = ["%s-%i" % (_id, step) for _id in ids]
+        vectors = rng.normal(size=(4, 3)).astype(np.float32)
+        file.append(ids, hashes, vectors)
+        for _id, text_hash, vector in zip(ids, hashes, vectors):
+            expected[_id] = (text_hash, vector)
+    assert (tmp_path / "sorted.bin").exists()
+
+    for reader in (file, VectorsFile(str(tmp_path))):
+        items = reader.get(list(expected))
+        assert set(items) == set(expected)
+        for _id, (text_hash, vector) in expected.items():
+            assert items[_id][0] == text_hash
+            np.testing.assert_array_equal(items[_id][1], vector)
+        assert {_id: text_hash for _id, text_hash, row in reader.items()} == {
+            _id: text_hash for _id, (text_hash, vector) in expected.items()}
+
+
+def test_id_longer_than_id_size(tmp_path):
+    file = VectorsFile(str(tmp_path))
+    with pytest.raises(ValueError):
+        file.append(["x" * 40], ["h"], np.ones((1, 3), dtype=np.float32))
+    assert file.get(["x" * 40]) == {}
@@ -29,8 +29,74 @@ MODELS = [
     'paraphrase-multilingual-mpnet-base-v2',
 ]
 DEFAULT_MODEL = os.getenv('DEFAULT_MODEL', default='paraphrase-xlm-r-multilingual-v1')
+# modelo usado na busca de papers por texto (search_papers)
+SEARCH_PAPERS_MODEL = os.getenv('SEARCH_PAPERS_MODEL', default=DEFAULT_MODEL)
+# memória (MB) para os modelos carregados em um processo,
+# os usados há mais tempo são descarregados (0 = sem limite)
+MODELS_MEMORY_BUDGET_MB = int(os.environ.get("MODELS_MEMORY_BUDGET_MB") or 0)
+# backend de inferência (CPU): torch, torch_int8 ou onnx
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', default='torch')
+# onde são criados os arquivos ONNX dos modelos (backend onnx)
+ONNX_PATH = os.getenv('ONNX_PATH', default=os.path.join(MODELS_PATH, "onnx"))
+# quantidade de threads usadas na inferência (0 = padrão do torch)
+TORCH_NUM_THREADS = int(os.environ.get("TORCH_NUM_THREADS") or 0)
+# carrega o modelo no processo principal do Celery, antes do fork dos workers
+PRELOAD_MODEL = bool(os.environ.get("PRELOAD_MODEL"))
+# agrupa os textos de tarefas concorrentes (`--pool=threads`) em uma só
+# chamada ao modelo, até ENCODE_BATCH_MAX_SIZE textos
+# ou até esperar ENCODE_BATCH_MAX_WAIT_MS milissegundos
+ENCODE_MICRO_BATCHING = bool(os.environ.get("ENCODE_MICRO_BATCHING"))
+ENCODE_BATCH_MAX_SIZE = int(os.environ.get("ENCODE_BATCH_MAX_SIZE") or 64)
+ENCODE_BATCH_MAX_WAIT_MS = float(os.environ.get("ENCODE_BATCH_MAX_WAIT_MS") or 5)
+# quantidade máxima de candidatos sem vetor armazenado processados pelo
+# modelo por comparação (os demais não são avaliados, ficam em `cut`)
 MAX_CANDIDATES = int(os.environ.get("MAX_CANDIDATES") or 20)
+# quantidade máxima de candidatos comparados com vetores armazenados
+MAX_SCORED_CANDIDATES = int(
+    os.environ.get("MAX_SCORED_CANDIDATES") or 100000)
 MIN_SCORE = float(os.environ.get("MIN_SCORE") or 0.7)
+# cache (de cada processo) dos textos dos papers usados na comparação
+PAPER_TEXTS_CACHE_SIZE = int(os.environ.get("PAPER_TEXTS_CACHE_SIZE") or 10000)
+PAPER_TEXTS_CACHE_SECONDS = int(
+    os.environ.get("PAPER_TEXTS_CACHE_SECONDS") or 600)
+# quantidade máxima de conexões de cada paper (as de maior score)
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS") or 100)
+# cache (de cada processo) dos dados dos papers apresentados nas conexões
+PAPER_SUMMARIES_CACHE_SIZE = int(
+    os.environ.get("PAPER_SUMMARIES_CACHE_SIZE") or 10000)
+PAPER_SUMMARIES_CACHE_SECONDS = int(
+    os.environ.get("PAPER_SUMMARIES_CACHE_SECONDS") or 600)
+# quantidade máxima de citações em cada documento de rs_source_citations
+CITATIONS_BUCKET_SIZE = int(os.environ.get("CITATIONS_BUCKET_SIZE") or 500)
+# quantidade máxima de papers avaliados (com score) por comparação
+TOP_K = int(os.environ.get("TOP_K") or 10)
+# quantidade de vetores comparados por vez
+SCORE_CHUNK_SIZE = int(os.environ.get("SCORE_CHUNK_SIZE") or 1000)
+
+# onde os vetores (embeddings) dos papers são armazenados
+# "db": MongoDB (rs_embedding)
+# "mmap": arquivos locais, lidos por memory map e compartilhados pelos workers
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", default="db")
+EMBEDDINGS_PATH = os.environ.get("EMBEDDINGS_PATH", default="st_embeddings")
+# formato dos vetores armazenados: float32, float16 ou int8
+EMBEDDINGS_DTYPE = os.environ.get("EMBEDDINGS_DTYPE", default="float32")
+
+# busca de papers por índice de vetores (IVF-flat)
+# em vez de busca textual + expansão por referências
+SEARCH_PAPERS_BY_VECTOR_INDEX = bool(os.environ.get("SEARCH_PAPERS_BY_VECTOR_INDEX"))
+# quantidade de listas do índice (0 = calculada a partir do total de vetores)
+VECTOR_INDEX_NLIST = int(os.environ.get("VECTOR_INDEX_NLIST") or 0)
+# quantidade de listas consultadas por busca
+VECTOR_INDEX_NPROBE = int(os.environ.get("VECTOR_INDEX_NPROBE") or 8)
+# abaixo desta quantidade de vetores, a busca é exata
+VECTOR_INDEX_MIN_TRAIN_SIZE = int(os.environ.get("VECTOR_INDEX_MIN_TRAIN_SIZE") or 10000)
+# intervalo para incorporar a versão atual do índice e os vetores novos
+VECTOR_INDEX_REFRESH_SECONDS = int(os.environ.get("VECTOR_INDEX_REFRESH_SECONDS") or 60)
+# pasta do índice gerado por build_index (uma subpasta por modelo)
+VECTOR_INDEX_PATH = os.environ.get("VECTOR_INDEX_PATH") or os.path.join(
+    EMBEDDINGS_PATH, "vector_index")
+# formato dos vetores mantidos em memória pelo índice: float32, float16 ou int8
+VECTOR_INDEX_DTYPE = os.environ.get("VECTOR_INDEX_DTYPE", default=EMBEDDINGS_DTYPE)
 
 ####################################################
 
@@ -56,6 +122,9 @@ GET_SEMANTIC_SEARCH_PARAMETERS_QUEUE = os.environ.get("GET_SEMANTIC_SEARCH_PARAM
 COMPARE_PAPERS_QUEUE = os.environ.get("COMPARE_PAPERS_QUEUE", 'high_priority')
 REGISTER_PAPERS_CONNECTIONS_QUEUE = os.environ.get("REGISTER_PAPERS_CONNECTIONS_QUEUE", 'high_priority')
 ADD_CONNECTION_QUEUE = os.environ.get("ADD_CONNECTION_QUEUE", 'low_priority')
+# chain: etapas de find_and_create_connections em tarefas encadeadas
+# fused: todas as etapas em uma tarefa (LINKS_REGISTRATION_QUEUE)
+LINKS_PIPELINE = os.environ.get("LINKS_PIPELINE") or 'chain'
 
 
 # Facilita entrada de dados a partir de vários datasets (csv)
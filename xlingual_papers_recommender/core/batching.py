@@ -0,0 +1,102 @@
+"""
+Agrupamento dinâmico (micro-batching) das chamadas ao modelo.
+
+Os textos de chamadas concorrentes (por exemplo, tarefas do Celery
+executadas com `--pool=threads`) são acumulados até atingir `max_batch_size`
+textos ou até esperar `max_wait_ms` milissegundos, processados pelo modelo
+em uma só chamada e os vetores são devolvidos a cada chamador.
+"""
+import os
+import time
+import queue
+import threading
+
+
+class _Request:
+
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EncodeBatcher:
+
+    def __init__(self, encode, max_batch_size, max_wait_ms):
+        """
+        Parameters
+        ----------
+        encode: callable
+            recebe lista de textos e retorna numpy.ndarray (um vetor por texto)
+        max_batch_size: int
+        max_wait_ms: float
+        """
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _start(self):
+        # a thread não sobrevive ao fork, cada processo inicia a sua
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def encode(self, sentences):
+        if not sentences:
+            return self._encode(sentences)
+        if self._pid != os.getpid():
+            self._start()
+        request = _Request(list(sentences))
+        self._queue.put(request)
+        request.done.wait()
+        if request.error:
+            raise request.error
+        return request.result
+
+    def _get_batch(self):
+        batch = [self._queue.get()]
+        size = len(batch[0].sentences)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.sentences)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._get_batch()
+            sentences = [
+                sentence
+                for request in batch
+                for sentence in request.sentences
+            ]
+            try:
+                vectors = self._encode(sentences)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            start = 0
+            for request in batch:
+                end = start + len(request.sentences)
+                request.result = vectors[start:end]
+                request.done.set()
+                start = end
@@ -1,16 +1,30 @@
+from collections import Counter
 from datetime import datetime
 from xlingual_papers_recommender.configuration import (
-    ITEMS_PER_PAGE, add_uri, get_years_range
+    ITEMS_PER_PAGE, add_uri, get_years_range,
+    SEARCH_PAPERS_BY_VECTOR_INDEX, SEARCH_PAPERS_MODEL,
 )
+from bson import ObjectId
+from mongoengine.errors import NotUniqueError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
 from xlingual_papers_recommender.utils import response_utils
-from xlingual_papers_recommender import exceptions
-from xlingual_papers_recommender.core import recommender
+from xlingual_papers_recommender.utils.lru_cache import LRUCache
+from xlingual_papers_recommender import exceptions, configuration
+from xlingual_papers_recommender.core import recommender, vector_index
 from xlingual_papers_recommender.db import (
     db,
 )
 from xlingual_papers_recommender.db.data_models import (
     Source,
     Paper,
+    PaperSources,
+    SourceCitations,
+    get_source_fingerprint,
+    create_reflink,
+    create_connection,
+    utcnow,
     PROC_STATUS_TODO,
     PROC_STATUS_DONE,
 )
@@ -87,7 +101,7 @@ def search_sources_by_data(doi, pub_year, surname, organization_author, source,
     return db.get_records(Source, **kwargs)
 
 
-def create_source(
+def build_source(
         pub_year, vol, num, suppl, page, surname, organization_author, doi,
         journal, paper_title, source, issn,
         thesis_date, thesis_loc, thesis_country, thesis_degree, thesis_org,
@@ -138,44 +152,342 @@ def create_source(
     _source.edition = edition or None
     _source.source_person_author_surname = source_person_author_surname or None
     _source.source_organization_author = source_organization_author or None
+    _source.normalize()
+    _source.fingerprint = _source.get_fingerprint()
+    return _source
+
+
+def create_source(**ref):
+    _source = build_source(**ref)
     _source.save()
     return _source
 
 
-def add_referenced_by_to_source(ref, paper_id, todo_mark, pid, year, subject_areas):
+def _get_or_create_source_id(_source):
+    """
+    Obtém o id da fonte pela impressão digital (índice único) ou a cria,
+    se não existir (upsert)
+
+    Returns
+    -------
+    tuple
+        (id da fonte, True se foi criada)
+    """
+    query_set = Source.objects(fingerprint=_source.fingerprint)
     try:
-        page = 1
-        items_per_page = 100
-        order_by = None
-        response = response_utils.create_response("add_referenced_by_to_source")
-        sources = search_sources(
-            ref['doi'], ref['pub_year'],
-            ref['surname'], ref['organization_author'],
-            ref['source'], ref['journal'], ref['vol'],
-            items_per_page, page, order_by,
+        result = query_set.update_one(
+            upsert=True, full_result=True,
+            __raw__={'$setOnInsert': _get_insert_data(_source)},
         )
-    except exceptions.InsuficientArgumentsToSearchDocumentError as e:
-        response_utils.add_exception(response, e)
-        return response
+    except NotUniqueError:
+        # criada por outro processo ao mesmo tempo
+        result = None
+    if result and result.upserted_id:
+        return result.upserted_id, True
+    return query_set.only('id').first().pk, False
+
+
+def add_citation(source_id, paper_id, reflink):
+    """
+    Registra que o paper cita a fonte: no índice de acoplamento bibliográfico
+    (`PaperSources`) e no bloco de citações da fonte do ano do paper
+    (`SourceCitations`)
+
+    Returns
+    -------
+    bool
+        False se o paper já estava registrado como citação da fonte
+    """
+    source_id = str(source_id)
     try:
-        _source = sources[0]
-    except (IndexError, TypeError, ValueError) as e:
-        _source = create_source(**ref)
-        _source.add_referenced_by(paper_id)
-        _source.add_reflink(paper_id, pid, year, subject_areas)
-        _source.save()
-        response_utils.add_result(response, "source created")
-        return response
+        # o filtro só atende se a fonte ainda não está registrada para o paper
+        result = PaperSources.objects(
+            paper_id=paper_id, source_ids__ne=source_id,
+        ).update_one(
+            upsert=True, full_result=True,
+            add_to_set__source_ids=source_id,
+            set__updated=utcnow(),
+            set_on_insert__created=utcnow(),
+        )
+    except NotUniqueError:
+        return False
+    if not result.upserted_id and not result.modified_count:
+        return False
+    _add_to_citations_bucket(source_id, reflink)
+    return True
+
+
+def _add_source_ids(paper_id, source_ids):
+    """
+    Acrescenta as fontes ao índice de acoplamento do paper (`PaperSources`)
+    em uma só operação (find and modify), que retorna o documento anterior
+
+    Returns
+    -------
+    set
+        ids das fontes que já estavam registradas para o paper
+    """
+    for retry in (True, False):
+        try:
+            previous = PaperSources.objects(paper_id=paper_id).modify(
+                upsert=True, new=False,
+                add_to_set__source_ids=source_ids,
+                set__updated=utcnow(),
+                set_on_insert__created=utcnow(),
+            )
+        except NotUniqueError:
+            # criado por outro processo ao mesmo tempo: agora é atualizado
+            if retry:
+                continue
+            raise
+        return set(previous.source_ids or []) if previous else set()
+
+
+def _add_to_citations_bucket(source_id, reflink):
+    # acrescenta ao bloco do ano que ainda não está completo ou cria outro
+    SourceCitations.objects(
+        source_id=source_id, year=reflink.year,
+        count__lt=configuration.CITATIONS_BUCKET_SIZE,
+    ).update_one(
+        upsert=True,
+        push__reflinks=reflink,
+        inc__count=1,
+        set__updated=utcnow(),
+        set_on_insert__created=utcnow(),
+    )
+
+
+def _is_in_citations_buckets(source_id, reflink):
+    return bool(SourceCitations.objects(
+        source_id=source_id, year=reflink.year,
+        reflinks__paper_id=reflink.paper_id,
+    ).only('id').first())
+
+
+def _get_insert_data(_source):
+    data = _source.to_mongo().to_dict()
+    for name in ('fingerprint', 'referenced_by', 'reflinks'):
+        data.pop(name, None)
+    data['created'] = data['updated'] = utcnow()
+    return data
+
+
+def add_sources_fingerprints():
+    """
+    Registra a impressão digital das fontes registradas antes de sua criação.
+    Fontes com dados equivalentes aos de outra fonte (duplicadas)
+    permanecem sem impressão digital
+    """
+    response = {"add_sources_fingerprints": 0, "duplicated": 0}
+    sources = db.iter_records(
+        Source,
+        fields=('doi', 'pub_year', 'surname', 'organization_author',
+                'journal', 'source', 'vol'),
+        fingerprint__exists=False,
+    )
+    for record in sources:
+        fingerprint = get_source_fingerprint(
+            record.get('doi'), record.get('pub_year'), record.get('surname'),
+            record.get('organization_author'), record.get('journal'),
+            record.get('source'), record.get('vol'),
+        )
+        if not fingerprint:
+            continue
+        try:
+            Source.objects(pk=record['_id']).update_one(
+                set__fingerprint=fingerprint)
+        except NotUniqueError:
+            response["duplicated"] += 1
+        else:
+            response["add_sources_fingerprints"] += 1
+    return response
+
+
+def add_referenced_by_to_source(ref, paper_id, todo_mark, pid, year, subject_areas):
+    response = response_utils.create_response("add_referenced_by_to_source")
+    paper_id = str(paper_id)
+
+    _source = build_source(**ref)
+    if _source.fingerprint:
+        source_id, created = _get_or_create_source_id(_source)
     else:
-        if paper_id not in _source.referenced_by:
-            _source.add_referenced_by(paper_id)
-            _source.add_reflink(paper_id, pid, year, subject_areas)
+        try:
+            page = 1
+            items_per_page = 100
+            order_by = None
+            sources = search_sources(
+                ref['doi'], ref['pub_year'],
+                ref['surname'], ref['organization_author'],
+                ref['source'], ref['journal'], ref['vol'],
+                items_per_page, page, order_by,
+            )
+        except exceptions.InsuficientArgumentsToSearchDocumentError as e:
+            response_utils.add_exception(response, e)
+            return response
+        try:
+            source_id, created = sources.only('id')[0].pk, False
+        except (IndexError, TypeError, ValueError):
             _source.save()
-            return todo_mark
+            source_id, created = _source.pk, True
 
-        response_utils.add_result(
-            response, "nothing to do: paper_id was registered in source")
+    added = add_citation(
+        source_id, paper_id,
+        create_reflink(paper_id, pid, year, subject_areas),
+    )
+    if created:
+        response_utils.add_result(response, "source created")
         return response
+    if added:
+        return todo_mark
+    response_utils.add_result(
+        response, "nothing to do: paper_id was registered in source")
+    return response
+
+
+def add_references_to_sources(refs, paper_id, todo_mark, pid, year, subject_areas):
+    """
+    Registra as citações de todas as referências de um paper:
+    as fontes são obtidas / criadas em lote (bulk_write) pela impressão
+    digital e as citações são registradas em lote.
+    As referências sem dados suficientes para a impressão digital são
+    registradas uma a uma (`add_referenced_by_to_source`)
+
+    Returns
+    -------
+    dict
+        resposta com as quantidades de fontes criadas (`created`),
+        de citações registradas (`added`), de referências já registradas
+        (`registered`), de referências registradas uma a uma (`searched`)
+        e, se alguma fonte existente passou a ser citada
+        pelo paper, `proc_status` igual a `todo_mark`
+    """
+    response = response_utils.create_response("add_references_to_sources")
+    paper_id = str(paper_id)
+    counts = {"created": 0, "added": 0, "registered": 0, "searched": 0}
+    todo = False
+
+    # fontes por impressão digital
+    fingerprints = {}
+    for ref in refs:
+        try:
+            _source = build_source(**ref)
+        except exceptions.SourceCreationInputError as e:
+            response_utils.add_exception(response, e)
+            continue
+        if _source.fingerprint:
+            fingerprints.setdefault(_source.fingerprint, _source)
+        else:
+            result = add_referenced_by_to_source(
+                ref, paper_id, todo_mark, pid, year, subject_areas)
+            todo = todo or result == todo_mark
+            counts["searched"] += 1
+
+    created = set()
+    if fingerprints:
+        operations = [
+            UpdateOne(
+                {'fingerprint': fingerprint},
+                {'$setOnInsert': _get_insert_data(_source)},
+                upsert=True,
+            )
+            for fingerprint, _source in fingerprints.items()
+        ]
+        keys = list(fingerprints.keys())
+        try:
+            result = Source._get_collection().bulk_write(
+                operations, ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            # criadas por outro processo ao mesmo tempo (duplicate key)
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            upserted = {
+                item['index']: item['_id'] for item in e.details['upserted']
+            }
+        created = set(keys[index] for index in upserted)
+        counts["created"] = len(created)
+
+    # ids das fontes, em uma só consulta
+    source_ids = {
+        record['fingerprint']: str(record['_id'])
+        for record in Source.objects(
+            fingerprint__in=list(fingerprints.keys()),
+        ).only('id', 'fingerprint').as_pymongo()
+    } if fingerprints else {}
+
+    # somente as fontes ainda não registradas para o paper
+    new_citations = {}
+    if source_ids:
+        registered = _add_source_ids(paper_id, list(source_ids.values()))
+        new_citations = {
+            fingerprint: source_id
+            for fingerprint, source_id in source_ids.items()
+            if source_id not in registered
+        }
+    counts["registered"] = len(source_ids) - len(new_citations)
+
+    if new_citations:
+        reflink = create_reflink(
+            paper_id, pid, year, subject_areas).to_mongo().to_dict()
+        SourceCitations._get_collection().bulk_write(
+            [
+                UpdateOne(
+                    {'source_id': source_id, 'year': reflink['year'],
+                     'count': {'$lt': configuration.CITATIONS_BUCKET_SIZE}},
+                    {'$push': {'reflinks': reflink},
+                     '$inc': {'count': 1},
+                     '$set': {'updated': utcnow()},
+                     '$setOnInsert': {'created': utcnow()}},
+                    upsert=True,
+                )
+                for source_id in new_citations.values()
+            ],
+            ordered=False,
+        )
+        counts["added"] += len(new_citations)
+        # fontes existentes passaram a ser citadas pelo paper
+        todo = todo or bool(set(new_citations.keys()) - created)
+
+    response.update(counts)
+    if todo:
+        response["proc_status"] = todo_mark
+    return response
+
+
+def migrate_citations():
+    """
+    Move `Source.referenced_by` / `Source.reflinks` das fontes registradas
+    antes de `SourceCitations` para `PaperSources` e `SourceCitations`.
+    Pode ser executada novamente, se interrompida: as citações que já
+    estão em `SourceCitations` não são acrescentadas de novo
+    """
+    response = {"migrate_citations": 0, "sources": 0}
+    sources = db.iter_records(
+        Source, fields=('reflinks', ), reflinks__exists=True)
+    for record in sources:
+        source_id = str(record['_id'])
+        for item in record.get('reflinks') or []:
+            reflink = create_reflink(
+                item.get('paper_id'), item.get('pid'), item.get('year'),
+                item.get('subject_areas'),
+            )
+            # os reflinks de uma fonte não se repetem,
+            # o paper pode já estar no índice de acoplamento bibliográfico
+            PaperSources.objects(paper_id=reflink.paper_id).update_one(
+                upsert=True,
+                add_to_set__source_ids=source_id,
+                set__updated=utcnow(),
+                set_on_insert__created=utcnow(),
+            )
+            if _is_in_citations_buckets(source_id, reflink):
+                # migração interrompida e executada novamente
+                continue
+            _add_to_citations_bucket(source_id, reflink)
+            response["migrate_citations"] += 1
+        Source.objects(pk=record['_id']).update_one(
+            unset__reflinks=True, unset__referenced_by=True)
+        response["sources"] += 1
+    return response
 
 
 def get_ids_connected_by_references(paper_id, subject_areas=None, from_year=None, to_year=None):
@@ -199,6 +511,8 @@ def get_ids_connected_by_references(paper_id, subject_areas=None, from_year=None
     Returns
     -------
     str list
+        sorted by the number of sources shared with the given paper,
+        the strongest first
 
     Raises
     ------
@@ -208,121 +522,256 @@ def get_ids_connected_by_references(paper_id, subject_areas=None, from_year=None
         raise exceptions.ReferenceConnectionSearchInputError(
             "get_ids_connected_by_references requires paper_id parameter"
         )
-    # query parameters to get the sources
-    # which reflinks have these attributes values
-    # but it does not return only the matched reflinks
-    params = dict(
-        referenced_by=paper_id,
-        reflinks__subject_areas__in=subject_areas,
-        reflinks__year__gte=int(from_year or 0),
-        reflinks__year__lte=int(to_year or 0),
-    )
-    kwargs = {
-        k: v
-        for k, v in params.items()
-        if v
-    }
-
-    # store the results as set in order not to get repetitions
-    reflinks = set()
-    for source in db.get_records(Source, **kwargs):
-        # reflinks are the data of the connected papers
-        t = source.get_reflinks_tuples()
-        reflinks.update(set(t))
-
-    # sort the results
-    reflinks = sorted(reflinks)
-
-    # filter the reflinks which match with given parameters
-    if any([subject_areas, from_year, to_year]):
-        return list(
-            _filter_reflinks(
-                reflinks, paper_id, subject_areas, from_year, to_year
-            )
-        )
-
-    # returns without filtering
     return [
-        item
-        for item in reflinks
-        if item[-1] != paper_id
+        _id
+        for _id, strength in get_coupling_strengths(
+            paper_id, subject_areas, from_year, to_year)
     ]
 
 
-def _filter_reflinks(reflinks, paper_id, subject_areas, from_year, to_year):
+def get_coupling_strengths(paper_id, subject_areas=None, from_year=None, to_year=None):
     """
-    Filter the reflinks which match with given subject areas, from_year, to_year
-    and returns papers ids generator
+    Get IDs of papers which are connected to a given paper (`paper_id`)
+    because they cite the same source and the number of sources
+    they share with the given paper (bibliographic coupling strength)
+
+    Parameters
+    ----------
+    paper_id: str
+        id of the given paper
+    subject_areas (optional): str list
+        filter by subject areas of the given paper
+    from_year (optional): str
+        used to select papers which publication year is
+        greater than or equal to `from_year`
+    to_year (optional): str
+        used to select papers which publication year is
+        lesser than or equal to `to_year`
+
+    Returns
+    -------
+    list
+        (paper id, number of shared sources),
+        sorted by the number of shared sources, the strongest first
     """
-    for item in reflinks:
-        if _valid_reflink(item, paper_id, subject_areas, from_year, to_year):
-            # paper id
-            yield item[-1]
+    strengths = _get_coupling_strengths_from_index(
+        paper_id, subject_areas, from_year, to_year)
+    if strengths is None:
+        # the paper is not in the coupling index yet
+        strengths = _get_coupling_strengths_from_reflinks(
+            paper_id, subject_areas, from_year, to_year)
+
+    # the strongest first, then by id in order to get the same results
+    return sorted(strengths.items(), key=lambda item: (-item[1], item[0]))
 
 
-def _valid_reflink(item, paper_id, subject_areas, from_year, to_year):
+def _get_coupling_strengths_from_index(paper_id, subject_areas, from_year, to_year):
     """
-    Filter the reflinks which match with given subject areas, from_year, to_year
-    and returns papers ids generator
+    Uses the coupling index: paper -> sources (`PaperSources`)
+    and source -> papers (`SourceCitations`), filtered by the database
+    (aggregation), which reads only the buckets of the years range
 
     Returns
     -------
-    bool
+    Counter or None (if the paper is not indexed)
+    """
+    try:
+        record = PaperSources.objects(
+            paper_id=str(paper_id)).only('source_ids').as_pymongo()[0]
+    except IndexError:
+        return None
+
+    pipeline = _get_buckets_pairs_pipeline(
+        paper_id, record.get('source_ids') or [],
+        subject_areas, from_year, to_year,
+    ) + [
+        {'$group': {'_id': '$_id.paper_id', 'strength': {'$sum': 1}}},
+    ]
+    items = SourceCitations.objects().aggregate(pipeline, allowDiskUse=True)
+    return Counter({item['_id']: item['strength'] for item in items})
+
+
+def _get_buckets_pairs_pipeline(paper_id, source_ids, subject_areas, from_year, to_year):
     """
-    reflink_year, reflink_subject_areas, ign, reflink_paper_id = item
+    Aggregation pipeline of `SourceCitations` which returns the distinct
+    pairs (source, connected paper id) of the given sources,
+    reading only the buckets of the years range
+    """
+    buckets_match = {'source_id': {'$in': list(source_ids)}}
+    years = {}
+    if from_year:
+        years['$gte'] = int(from_year)
+    if to_year:
+        years['$lte'] = int(to_year)
+    if years:
+        buckets_match['year'] = years
 
-    if paper_id == reflink_paper_id:
-        # it is itself, skip
-        return False
+    reflinks_match = {'reflinks.paper_id': {'$ne': str(paper_id)}}
+    if subject_areas:
+        reflinks_match['reflinks.subject_areas'] = {'$in': list(subject_areas)}
 
-    if subject_areas and not (set(subject_areas) & set(reflink_subject_areas)):
-        return False
+    return [
+        {'$match': buckets_match},
+        {'$project': {'source_id': 1, 'reflinks.paper_id': 1,
+                      'reflinks.subject_areas': 1}},
+        {'$unwind': '$reflinks'},
+        {'$match': reflinks_match},
+        # each source counts once for each connected paper
+        {'$group': {'_id': {'source': '$source_id',
+                            'paper_id': '$reflinks.paper_id'}}},
+    ]
 
-    if from_year and to_year:
-        return from_year <= reflink_year <= to_year
-    if from_year and (from_year <= reflink_year):
-        return True
+
+def _get_coupling_strengths_from_reflinks(paper_id, subject_areas, from_year, to_year):
+    """
+    Uses the sources reflinks (citations registered before `SourceCitations`)
+    and the buckets of the same sources (citations registered after it),
+    filtered by the database (aggregation), which return only the distinct
+    pairs (source, connected paper id)
+    """
+    # reflinks which match with given parameters
+    reflinks_match = {'reflinks.paper_id': {'$ne': paper_id}}
+    if subject_areas:
+        reflinks_match['reflinks.subject_areas'] = {'$in': list(subject_areas)}
+    years = {}
+    if from_year:
+        years['$gte'] = int(from_year)
     if to_year:
-        return reflink_year <= to_year
-    return False
+        years['$lte'] = int(to_year)
+    if years:
+        reflinks_match['reflinks.year'] = years
+
+    pipeline = [
+        {'$project': {'reflinks.paper_id': 1, 'reflinks.year': 1,
+                      'reflinks.subject_areas': 1}},
+        {'$unwind': '$reflinks'},
+        {'$match': reflinks_match},
+        # each source counts once for each connected paper
+        {'$group': {'_id': {'source': '$_id',
+                            'paper_id': '$reflinks.paper_id'}}},
+    ]
+    # the sources are selected by index (referenced_by)
+    sources = Source.objects(referenced_by=paper_id)
+    pairs = set(
+        (str(item['_id']['source']), item['_id']['paper_id'])
+        for item in sources.aggregate(pipeline, allowDiskUse=True)
+    )
+
+    source_ids = [str(record['_id']) for record in sources.only('id').as_pymongo()]
+    if source_ids:
+        pipeline = _get_buckets_pairs_pipeline(
+            paper_id, source_ids, subject_areas, from_year, to_year)
+        pairs.update(
+            (item['_id']['source'], item['_id']['paper_id'])
+            for item in SourceCitations.objects().aggregate(
+                pipeline, allowDiskUse=True)
+        )
+    return Counter(_id for source_id, _id in pairs)
 
 
 def get_semantic_search_parameters(selected_ids, paper_id=None):
     parameters = {}
     if selected_ids:
-        # obtém os textos dos artigos
+        # obtém os textos dos artigos (e do artigo principal) em uma consulta
+        texts = _get_texts(list(selected_ids) + ([paper_id] if paper_id else []))
         parameters['ids'], parameters['texts'] = (
-            get_texts_for_semantic_search(selected_ids)
+            _select_texts(selected_ids, texts)
         )
 
         if paper_id:
-            ign, text = (
-                get_texts_for_semantic_search([paper_id])
-            )
-            parameters['text'] = text[0]
+            parameters['text'] = texts.get(str(paper_id))
+            parameters['paper_id'] = paper_id
+            if not parameters['text']:
+                # sem o texto do paper principal não há o que comparar
+                parameters = {}
     print("get_semantic_search_parameters", len(parameters))
     return parameters
 
 
+_TEXT_FIELDS = ('paper_titles', 'abstracts', 'keywords')
+
+
 def get_text_for_semantic_search(paper):
+    """
+    Texto do paper usado na comparação e no hash do vetor armazenado,
+    o mesmo no registro do paper e na comparação
+
+    Parameters
+    ----------
+    paper: Paper ou dict
+        dict: registro obtido com `as_pymongo`
+    """
     _text = []
     if not paper:
         return ""
 
-    for items in (paper.paper_titles, paper.abstracts, paper.keywords):
-        for item in items:
-            _text.append(item.text)
+    is_dict = isinstance(paper, dict)
+    for name in _TEXT_FIELDS:
+        items = paper.get(name) if is_dict else getattr(paper, name)
+        for item in items or []:
+            text = item.get('text') if is_dict else item.text
+            if text:
+                _text.append(text)
 
     if _text:
         return "\n".join(_text)
 
 
-def get_texts_for_semantic_search(paper_ids):
+# paper _id -> (Paper.updated, texto para a busca semântica)
+# o texto em cache só é usado se `updated` não mudou, porque o paper pode
+# ter sido registrado novamente por outro processo
+_TEXTS = LRUCache(
+    configuration.PAPER_TEXTS_CACHE_SIZE,
+    configuration.PAPER_TEXTS_CACHE_SECONDS,
+)
+
+
+def _get_texts(paper_ids):
+    """
+    Obtém os textos dos papers: uma consulta somente com `updated`, para
+    validar o cache, e uma consulta somente com os campos dos textos,
+    para os papers que não estão em cache ou que mudaram
+
+    Returns
+    -------
+    dict
+        paper _id -> texto
+    """
+    ids = list(set(str(_id) for _id in paper_ids))
+    if not ids:
+        return {}
+    texts = {}
+    missing = []
+    for record in Paper.objects(pk__in=ids).only('updated').as_pymongo():
+        _id = str(record['_id'])
+        updated = record.get('updated')
+        cached = _TEXTS.get(_id)
+        if cached is not None and updated and cached[0] == updated:
+            texts[_id] = cached[1]
+        else:
+            missing.append(_id)
+    if missing:
+        records = Paper.objects(pk__in=missing).only(
+            'updated',
+            *['%s.text' % name for name in _TEXT_FIELDS]).as_pymongo()
+        for record in records:
+            _id = str(record['_id'])
+            text = get_text_for_semantic_search(record)
+            if text:
+                texts[_id] = text
+                _TEXTS.set(_id, (record.get('updated'), text))
+    return texts
+
+
+def forget_text_for_semantic_search(paper_id):
+    _TEXTS.pop(str(paper_id))
+
+
+def _select_texts(paper_ids, texts):
     selection = []
     valid_paper_ids = []
     for _id in paper_ids:
-        print("get_texts_for_semantic_search", _id)
-        text = get_text_for_semantic_search(get_paper_by_record_id(_id))
+        text = texts.get(str(_id))
         if text:
             selection.append(text)
             valid_paper_ids.append(_id)
@@ -330,6 +779,16 @@ def get_texts_for_semantic_search(paper_ids):
     return valid_paper_ids, selection
 
 
+def get_texts_for_semantic_search(paper_ids):
+    """
+    Returns
+    -------
+    tuple
+        (ids dos papers que têm texto, textos), na ordem de `paper_ids`
+    """
+    return _select_texts(paper_ids, _get_texts(paper_ids))
+
+
 def get_paper_by_record_id(_id):
     try:
         return db.get_record_by__id(Paper, _id)
@@ -343,66 +802,118 @@ def register_papers_connections(paper_id, evaluated, ids):
     """
     Register links
     """
-    registered_paper = get_paper_by_record_id(paper_id)
-    registered_paper.connections = []
-    for item in evaluated:
-        registered_paper.add_connection(item['paper_id'], item['score'])
-    for item in ids:
-        registered_paper.add_connection(item)
-
-    if evaluated:
-        registered_paper.proc_status = PROC_STATUS_DONE
-
-    registered_paper.save()
-    return registered_paper.get_connections()
-
-
-# def find_and_create_connections(paper_id):
-#     response = response_utils.create_response("find_and_create_connections")
-#     paper = get_paper_by_record_id(paper_id)
-#     if paper.proc_status != PROC_STATUS_TODO:
-#         response_utils.add_result(
-#             response, "Nothing done: PROC_STATUS=%s" % paper.proc_status)
-#         return response
-
-#     years_range = get_years_range(paper)
-#     ids = get_ids_connected_by_references(
-#         paper_id, paper.subject_areas, *years_range)
-#     if not ids:
-#         response_utils.add_result(response, "There is no `ids` to make links")
-#         return response
-
-#     parameters = get_semantic_search_parameters(ids, paper_id)
-#     if not parameters:
-#         response_utils.add_result(
-#             response, "There is no `parameters` to make links")
-#         return response
-
-#     papers = recommender.compare_papers(**parameters)
-#     if not papers:
-#         response_utils.add_result(response, "Not found paper links")
-#         return response
-
-#     result = register_papers_connections(
-#         paper_id,
-#         papers['evaluated'],
-#         papers['cut'],
-#     )
-#     return result
+    get_paper_by_record_id(paper_id)
+    # o resultado da comparação substitui as conexões anteriores do paper;
+    # as conexões são gravadas com $push ($sort e $slice), como as
+    # conexões inversas
+    push_connections(
+        [(paper_id, item['paper_id'], item['score']) for item in evaluated] +
+        [(paper_id, item, None) for item in ids],
+        replace=True,
+    )
+    # a comparação foi executada, mesmo que não tenha encontrado papers
+    Paper.objects(pk=paper_id).update_one(
+        set__proc_status=PROC_STATUS_DONE,
+        set__updated=utcnow(),
+    )
+    return get_paper_by_record_id(paper_id).get_connections()
+
+
+def push_connections(items, replace=False):
+    """
+    Acrescenta / substitui conexões em lote (bulk_write), mantendo as
+    conexões de cada paper ordenadas por score (as sem score por último)
+    e limitadas a `configuration.MAX_CONNECTIONS`.
+    Para cada paper, são executadas somente duas operações: a remoção das
+    conexões anteriores com os mesmos papers ($pull com $in), ou de todas
+    as conexões se `replace`, e o acréscimo das novas ($push com $each)
+
+    Parameters
+    ----------
+    items: list
+        (paper_id, connected_paper_id, score), score pode ser None
+    replace: bool
+        substitui todas as conexões dos papers
+
+    Returns
+    -------
+    tuple
+        (quantidade de conexões acrescentadas,
+         ids dos papers conectados que não estão registrados)
+    """
+    # um score por par (o último)
+    scores = {}
+    for paper_id, connected_paper_id, score in items:
+        scores.setdefault(str(paper_id), {})[str(connected_paper_id)] = score
+
+    connected_ids = set()
+    for connected in scores.values():
+        connected_ids.update(connected.keys())
+    registered = {
+        paper._id: paper
+        for paper in Paper.objects(
+            pk__in=list(connected_ids | set(scores.keys())),
+        ).only('pid', 'pub_year')
+    }
+    not_registered = sorted(connected_ids - set(registered.keys()))
+
+    operations = []
+    added = 0
+    for paper_id, connected in scores.items():
+        new_connections = [
+            create_connection(registered[connected_paper_id], score).to_mongo()
+            for connected_paper_id, score in connected.items()
+            if connected_paper_id in registered
+        ]
+        if paper_id not in registered or not new_connections:
+            continue
+        if replace:
+            remove = {'$set': {'connections': []}}
+        else:
+            remove = {'$pull': {'connections': {
+                '_id': {'$in': [item['_id'] for item in new_connections]}}}}
+        operations.append(UpdateOne({'_id': ObjectId(paper_id)}, remove))
+        operations.append(UpdateOne(
+            {'_id': ObjectId(paper_id)},
+            {'$push': {'connections': {
+                '$each': new_connections,
+                '$sort': {'score': -1},
+                '$slice': configuration.MAX_CONNECTIONS,
+             }},
+             '$set': {'updated': utcnow()}},
+        ))
+        added += len(new_connections)
+    if operations:
+        # ordered: em cada paper, a remoção antecede o acréscimo
+        Paper._get_collection().bulk_write(operations, ordered=True)
+    return added, not_registered
 
 
 ##############################################################################
 
-def search_papers(text, subject_areas, from_year, to_year):
-    selected_ids = _select_papers_ids_by_text(
-        text, subject_areas, from_year, to_year)
-    parameters = get_semantic_search_parameters(selected_ids)
+def search_papers(text, subject_areas, from_year, to_year, model_name=None):
+    if isinstance(subject_areas, str):
+        subject_areas = [subject_areas]
+    model_name = model_name or SEARCH_PAPERS_MODEL
+
+    if SEARCH_PAPERS_BY_VECTOR_INDEX:
+        evaluated = vector_index.search(
+            text, ITEMS_PER_PAGE, subject_areas, from_year, to_year,
+            model_name)
+    else:
+        selected_ids = _select_papers_ids_by_text(
+            text, subject_areas, from_year, to_year)
+        parameters = get_semantic_search_parameters(selected_ids)
+
+        # a busca apresenta os mais similares, mesmo abaixo de MIN_SCORE
+        papers = recommender.compare_papers(
+            text, parameters['ids'], parameters['texts'],
+            model_name=model_name, top_k=ITEMS_PER_PAGE, min_score=0,
+        )
+        evaluated = papers['evaluated']
 
-    papers = recommender.compare_papers(
-        text, parameters['ids'], parameters['texts']
-    )
     items = []
-    for item in papers['evaluated']:
+    for item in evaluated:
         paper = get_paper_by_record_id(item['paper_id'])
         paper_data = add_uri(paper.as_dict())
         paper_data['score'] = item['score']
@@ -410,6 +921,7 @@ def search_papers(text, subject_areas, from_year, to_year):
 
     response = {
         "text": text,
+        "model_name": model_name,
         "recommendations": items,
     }
     return response
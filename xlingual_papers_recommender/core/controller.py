@@ -9,6 +9,7 @@ from xlingual_papers_recommender.db.data_models import (
     PROC_STATUS_NA,
     PROC_STATUS_SOURCE_REGISTERED,
     PROC_STATUS_TODO,
+    get_paper_connections,
 )
 
 
@@ -31,8 +32,9 @@ def get_subject_areas(journal_issn):
         return journal.subject_areas
 
 
-def search_papers(text, subject_area, from_year, to_year):
-    return connections.search_papers(text, subject_area, from_year, to_year)
+def search_papers(text, subject_area, from_year, to_year, model_name=None):
+    return connections.search_papers(
+        text, subject_area, from_year, to_year, model_name)
 
 
 def register_paper(network_collection, pid, main_lang, doi, pub_year,
@@ -89,24 +91,28 @@ def _register_refs_sources(paper):
         print("register_refs_sources", paper.proc_status)
         return response
 
-    for ref in paper.references:
-        if not ref.has_data_enough:
-            continue
-        try:
-            print("call tasks.add_referenced_by_to_source")
-            result = tasks.add_referenced_by_to_source(
-                ref.as_dict, paper._id,
-                paper.pid, paper.pub_year, paper.subject_areas,
-                paper.proc_status == PROC_STATUS_SOURCE_REGISTERED,
-            )
-            print(result)
-            if result == PROC_STATUS_TODO:
-                paper.proc_status = PROC_STATUS_TODO
-                paper.save()
-
-        except Exception as e:
-            response_utils.add_error(response, "Unable to create/update source", "")
-            response_utils.add_exception(response, e)
+    refs = [
+        ref.as_dict
+        for ref in paper.references
+        if ref.has_data_enough
+    ]
+    if not refs:
+        return response
+    try:
+        print("call tasks.add_references_to_sources")
+        result = tasks.add_references_to_sources(
+            refs, paper._id,
+            paper.pid, paper.pub_year, paper.subject_areas,
+            paper.proc_status == PROC_STATUS_SOURCE_REGISTERED,
+        )
+        print(result)
+        if (result or {}).get("proc_status") == PROC_STATUS_TODO:
+            paper.proc_status = PROC_STATUS_TODO
+            paper.save()
+
+    except Exception as e:
+        response_utils.add_error(response, "Unable to create/update source", "")
+        response_utils.add_exception(response, e)
     return response
 
 
@@ -115,6 +121,17 @@ def find_and_create_connections(paper_pid):
     return tasks.find_and_create_connections(paper._id)
 
 
-def get_connected_papers(pid, min_score=None):
-    registered_paper = papers.get_paper_by_pid(pid)
-    return registered_paper.get_connections(min_score)
+def get_task_status(task_id):
+    return tasks.get_task_status(task_id)
+
+
+def migrate_citations():
+    return connections.migrate_citations()
+
+
+def add_sources_fingerprints():
+    return connections.add_sources_fingerprints()
+
+
+def get_connected_papers(pid, min_score=None, limit=None, offset=None):
+    return get_paper_connections(pid, min_score, limit, offset)
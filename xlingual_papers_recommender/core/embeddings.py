@@ -0,0 +1,319 @@
+"""
+Armazena os vetores (embeddings) dos textos dos papers por paper `_id`,
+nome do modelo e hash do texto, para que os textos não sejam processados
+pelo modelo novamente a cada comparação
+
+O armazenamento é definido por `configuration.EMBEDDINGS_BACKEND`:
+- "db": MongoDB (rs_embedding)
+- "mmap": arquivos locais, lidos por memory map (`utils.vectors_file`)
+"""
+import os
+import hashlib
+import logging
+
+import numpy as np
+
+from xlingual_papers_recommender import configuration
+from xlingual_papers_recommender.core import semantics, quantization
+from xlingual_papers_recommender.db.data_models import PaperEmbedding, utcnow
+from xlingual_papers_recommender.utils.vectors_file import VectorsFile
+
+
+_DTYPE = np.float32
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _from_bytes(data, dtype=None, scale=None):
+    values = np.frombuffer(data, dtype=dtype or _DTYPE)
+    return quantization.dequantize(values, scale)
+
+
+class DBVectorsStore:
+    """
+    Vetores armazenados no MongoDB, no formato `dtype`
+    (float32, float16 ou int8)
+    """
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+
+    def get(self, paper_ids, model_name):
+        records = PaperEmbedding.objects(
+            paper_id__in=list(paper_ids),
+            model_name=model_name,
+        ).only('paper_id', 'text_hash', 'vector', 'dtype', 'scale')
+        return {
+            record.paper_id: (
+                record.text_hash,
+                _from_bytes(record.vector, record.dtype, record.scale),
+            )
+            for record in records
+        }
+
+    def put(self, paper_ids, text_hashes, vectors, model_name):
+        values, scales = quantization.quantize(vectors, self.dtype)
+        for i, (paper_id, text_hash) in enumerate(zip(paper_ids, text_hashes)):
+            PaperEmbedding.objects(
+                paper_id=paper_id, model_name=model_name,
+            ).update_one(
+                upsert=True,
+                set__text_hash=text_hash,
+                set__vector=values[i].tobytes(),
+                set__dtype=self.dtype,
+                set__scale=None if scales is None else float(scales[i]),
+                set__updated=utcnow(),
+                set_on_insert__created=utcnow(),
+            )
+
+    def iter_updates(self, model_name, since=None):
+        """
+        Itera (paper_id, vetor, marca) dos vetores atualizados depois de `since`
+        """
+        kwargs = {'model_name': model_name}
+        if since:
+            kwargs['updated__gt'] = since
+        records = PaperEmbedding.objects(**kwargs).only(
+            'paper_id', 'vector', 'dtype', 'scale', 'updated',
+        ).order_by('updated')
+        for record in records:
+            yield (
+                record.paper_id,
+                _from_bytes(record.vector, record.dtype, record.scale),
+                record.updated,
+            )
+
+
+class MmapVectorsStore:
+    """
+    Vetores armazenados em arquivos locais (um por modelo), compartilhados
+    pelos workers do mesmo host
+    """
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = dtype
+        self._files = {}
+
+    def get_file(self, model_name):
+        try:
+            return self._files[model_name]
+        except KeyError:
+            self._files[model_name] = VectorsFile(
+                os.path.join(self.path, model_name), self.dtype)
+            return self._files[model_name]
+
+    def get(self, paper_ids, model_name):
+        return {
+            paper_id: (text_hash, quantization.dequantize(values, scale))
+            for paper_id, (text_hash, values, scale) in
+            self.get_file(model_name).get(paper_ids).items()
+        }
+
+    def put(self, paper_ids, text_hashes, vectors, model_name):
+        vectors_file = self.get_file(model_name)
+        # o formato do arquivo existente prevalece
+        values, scales = quantization.quantize(
+            vectors, vectors_file.dtype.name)
+        vectors_file.append(paper_ids, text_hashes, values, scales)
+
+    def iter_updates(self, model_name, since=None):
+        """
+        Itera (paper_id, vetor, marca) dos vetores acrescentados depois
+        da linha `since`
+        """
+        vectors_file = self.get_file(model_name)
+        since = -1 if since is None else since
+        items = sorted(
+            (row, paper_id)
+            for paper_id, text_hash, row in vectors_file.items()
+            if row > since
+        )
+        matrix = vectors_file.matrix
+        scales = vectors_file.scales
+        for row, paper_id in items:
+            yield (
+                paper_id,
+                quantization.dequantize(
+                    matrix[row], None if scales is None else scales[row]),
+                row,
+            )
+
+
+_STORE = None
+
+
+def get_store():
+    global _STORE
+    if _STORE is None:
+        if configuration.EMBEDDINGS_BACKEND == "mmap":
+            _STORE = MmapVectorsStore(
+                configuration.EMBEDDINGS_PATH, configuration.EMBEDDINGS_DTYPE)
+        else:
+            _STORE = DBVectorsStore(configuration.EMBEDDINGS_DTYPE)
+    return _STORE
+
+
+def get_stored_vectors(paper_ids, model_name=None):
+    """
+    Obtém os vetores armazenados
+
+    Returns
+    -------
+    dict
+        key: paper_id, value: (text_hash, numpy.ndarray)
+    """
+    model_name = semantics.get_model_name(model_name)
+    return get_store().get(paper_ids, model_name)
+
+
+def store_vectors(paper_ids, text_hashes, vectors, model_name=None):
+    model_name = semantics.get_model_name(model_name)
+    get_store().put(paper_ids, text_hashes, vectors, model_name)
+
+
+def get_vectors(paper_ids, texts, model_name=None):
+    """
+    Obtém os vetores dos textos dos papers.
+    Somente os textos que ainda não têm vetor armazenado (ou cujo texto mudou)
+    são processados pelo modelo e, em seguida, armazenados
+
+    Parameters
+    ----------
+    paper_ids: str list
+    texts: str list
+        textos dos papers, na mesma ordem de `paper_ids`
+    model_name: str
+
+    Returns
+    -------
+    numpy.ndarray
+        vetores na mesma ordem de `paper_ids`
+    """
+    positions, vectors, encoded = get_available_vectors(
+        paper_ids, texts, model_name)
+    return vectors
+
+
+def get_available_vectors(paper_ids, texts, model_name=None, max_encoded=None):
+    """
+    Obtém os vetores armazenados dos textos dos papers e processa pelo
+    modelo, no máximo, `max_encoded` textos sem vetor armazenado
+    (ou cujo texto mudou)
+
+    Parameters
+    ----------
+    paper_ids: str list
+    texts: str list
+        textos dos papers, na mesma ordem de `paper_ids`
+    model_name: str
+    max_encoded: int
+        quantidade máxima de textos processados pelo modelo (None = todos)
+
+    Returns
+    -------
+    tuple
+        (posições em `paper_ids` dos papers que têm vetor,
+         vetores na mesma ordem das posições,
+         quantidade de textos processados pelo modelo)
+    """
+    text_hashes = [get_text_hash(text) for text in texts]
+    stored = get_stored_vectors(paper_ids, model_name) if paper_ids else {}
+
+    vectors = [None] * len(texts)
+    missing = []
+    for i, (paper_id, text_hash) in enumerate(zip(paper_ids, text_hashes)):
+        stored_hash, vector = stored.get(paper_id) or (None, None)
+        if stored_hash == text_hash:
+            vectors[i] = vector
+        else:
+            missing.append(i)
+
+    if max_encoded is not None:
+        missing = missing[:max(0, max_encoded)]
+    if missing:
+        LOGGER.debug("encode %i of %i", len(missing), len(texts))
+        new_vectors = semantics.encode([texts[i] for i in missing], model_name)
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+        store_vectors(
+            [paper_ids[i] for i in missing],
+            [text_hashes[i] for i in missing],
+            new_vectors,
+            model_name,
+        )
+    positions = [i for i, vector in enumerate(vectors) if vector is not None]
+    if not positions:
+        return positions, np.empty((0, 0), dtype=_DTYPE), len(missing)
+    return (
+        positions,
+        np.vstack([vectors[i] for i in positions]).astype(_DTYPE, copy=False),
+        len(missing),
+    )
+
+
+def get_vector(text, paper_id=None, model_name=None):
+    """
+    Obtém o vetor do texto principal.
+    Se `paper_id` é informado, usa / armazena o vetor do paper
+    """
+    if paper_id:
+        return get_vectors([paper_id], [text], model_name)[0]
+    return semantics.encode([text], model_name)[0]
+
+
+def register_paper_embedding(paper_id, text, model_name=None):
+    """
+    Gera e armazena o vetor do texto do paper, no momento do seu registro
+    """
+    if not text:
+        return
+    get_vectors([paper_id], [text], model_name)
+
+
+def embed_papers(paper_ids, texts, model_name=None, force_update=False,
+                 batch_size=None):
+    """
+    Gera e armazena os vetores de muitos papers de uma vez, agrupando os
+    textos por quantidade de tokens (`semantics.encode_by_length`)
+
+    Parameters
+    ----------
+    paper_ids: str list
+    texts: str list
+    model_name: str
+    force_update: bool
+        gera os vetores mesmo que já estejam armazenados
+    batch_size: int
+
+    Returns
+    -------
+    dict
+        encoded, skipped, padding_ratio, unsorted_padding_ratio, tokens
+    """
+    text_hashes = [get_text_hash(text) for text in texts]
+    selected = list(range(len(paper_ids)))
+    if not force_update:
+        stored = get_stored_vectors(paper_ids, model_name)
+        selected = [
+            i for i in selected
+            if (stored.get(paper_ids[i]) or (None, ))[0] != text_hashes[i]
+        ]
+    result = {"encoded": len(selected), "skipped": len(paper_ids) - len(selected)}
+    if not selected:
+        return result
+
+    vectors, stats = semantics.encode_by_length(
+        [texts[i] for i in selected], batch_size, model_name)
+    store_vectors(
+        [paper_ids[i] for i in selected],
+        [text_hashes[i] for i in selected],
+        vectors,
+        model_name,
+    )
+    result.update(stats)
+    return result
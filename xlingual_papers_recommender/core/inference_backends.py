@@ -0,0 +1,136 @@
+"""
+Backends de inferência (CPU) para o modelo sentence-transformer
+
+- torch: modelo PyTorch original
+- torch_int8: quantização dinâmica (int8) das camadas lineares
+- onnx: o transformer é exportado para ONNX e executado pelo onnxruntime,
+  as demais camadas (pooling, dense, normalize) continuam em PyTorch
+
+Este módulo importa torch, deve ser importado somente ao carregar o modelo
+"""
+import os
+
+import torch
+
+
+BACKENDS = ("torch", "torch_int8", "onnx")
+
+
+def set_num_threads(num_threads):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+
+def quantize_dynamic(model):
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_onnx(transformer, onnx_file_path):
+    """
+    Exporta o modelo do HuggingFace usado pelo módulo
+    `sentence_transformers.models.Transformer`
+    """
+    features = transformer.tokenize(["export"])
+    auto_model = transformer.auto_model
+    auto_model.eval()
+    folder = os.path.dirname(onnx_file_path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    torch.onnx.export(
+        auto_model,
+        (features["input_ids"], features["attention_mask"]),
+        onnx_file_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "last_hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=13,
+    )
+
+
+class OnnxTransformer(torch.nn.Module):
+    """
+    Substitui o primeiro módulo (Transformer) do SentenceTransformer,
+    mantendo o tokenizador original
+    """
+
+    def __init__(self, transformer, onnx_file_path, num_threads=None):
+        super().__init__()
+        import onnxruntime
+
+        self.transformer = transformer
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            onnx_file_path, options, providers=["CPUExecutionProvider"])
+
+    @property
+    def tokenizer(self):
+        return self.transformer.tokenizer
+
+    @property
+    def max_seq_length(self):
+        return self.transformer.max_seq_length
+
+    def get_word_embedding_dimension(self):
+        return self.transformer.get_word_embedding_dimension()
+
+    def tokenize(self, texts):
+        return self.transformer.tokenize(texts)
+
+    def forward(self, features):
+        inputs = {
+            "input_ids": features["input_ids"].cpu().numpy(),
+            "attention_mask": features["attention_mask"].cpu().numpy(),
+        }
+        token_embeddings = torch.from_numpy(
+            self.session.run(["last_hidden_state"], inputs)[0])
+        features.update({
+            "token_embeddings": token_embeddings,
+            "cls_token_embeddings": token_embeddings[:, 0, :],
+        })
+        return features
+
+
+def use_onnx(model, onnx_file_path, num_threads=None):
+    transformer = model._first_module()
+    if not os.path.isfile(onnx_file_path):
+        export_onnx(transformer, onnx_file_path)
+    modules = list(model._modules.keys())
+    model._modules[modules[0]] = OnnxTransformer(
+        transformer, onnx_file_path, num_threads)
+    return model
+
+
+def apply_backend(model, backend, onnx_file_path=None, num_threads=None):
+    """
+    Aplica o backend ao modelo (SentenceTransformer) já carregado
+
+    Parameters
+    ----------
+    model: SentenceTransformer
+    backend: str
+        torch, torch_int8, onnx
+    onnx_file_path: str
+        arquivo ONNX (criado, se não existir)
+    num_threads: int
+        quantidade de threads usadas pelo torch / onnxruntime (0 = padrão)
+
+    Returns
+    -------
+    SentenceTransformer
+    """
+    if backend not in BACKENDS:
+        raise ValueError("backend must be one of %s" % str(BACKENDS))
+    set_num_threads(num_threads)
+    model.eval()
+    if backend == "torch_int8":
+        return quantize_dynamic(model)
+    if backend == "onnx":
+        return use_onnx(model, onnx_file_path, num_threads)
+    return model
@@ -5,11 +5,15 @@ from xlingual_papers_recommender import exceptions
 from xlingual_papers_recommender import configuration
 from xlingual_papers_recommender.db.data_models import (
     Paper,
+    forget_connection_summary,
     PROC_STATUS_NA,
     PROC_STATUS_SOURCE_REGISTERED,
     PROC_STATUS_TODO,
 )
 from xlingual_papers_recommender.utils import response_utils
+from xlingual_papers_recommender.core import (
+    connections, embeddings, recommender,
+)
 
 
 REFERENCE_ATTRIBUTES = (
@@ -94,9 +98,30 @@ def register_paper(network_collection, pid, main_lang, doi, pub_year,
         # FIXME error code depende da excecao
         response_utils.add_error(response, "Unable to create paper", 400)
         response_utils.add_exception(response, e)
+        return response
+
+    # o texto do paper pode ter mudado
+    connections.forget_text_for_semantic_search(registered_paper._id)
+    forget_connection_summary(registered_paper._id)
+    _register_paper_embedding(registered_paper, response)
     return response
 
 
+def _register_paper_embedding(paper, response):
+    """
+    Gera e armazena o vetor do texto do paper para não ter que gerá-lo
+    a cada comparação
+    """
+    try:
+        embeddings.register_paper_embedding(
+            paper._id, connections.get_text_for_semantic_search(paper))
+        response_utils.add_result(response, "paper embedding registered")
+    except Exception as e:
+        # o vetor será gerado no momento da comparação
+        response_utils.add_result(
+            response, "Unable to register paper embedding: %s" % e)
+
+
 def _register_paper(paper, network_collection, pid, main_lang, doi, pub_year,
                     uri,
                     subject_areas,
@@ -204,7 +229,70 @@ def get_parameters_to_get_ids_connected_by_references(paper_id):
     return None
 
 
+def find_and_create_connections(paper_id):
+    """
+    Executa todas as etapas da criação das conexões do paper no mesmo
+    processo (sem tarefas intermediárias): obtém os papers conectados
+    pelas referências, os seus textos, compara os textos e registra as
+    conexões e as conexões inversas
+    """
+    response = response_utils.create_response("find_and_create_connections")
+    paper_data = get_parameters_to_get_ids_connected_by_references(paper_id)
+    if not paper_data:
+        response_utils.add_result(
+            response, "Do nothing. Paper status is not PROC_STATUS_TODO")
+        return response
+
+    ids = connections.get_ids_connected_by_references(**paper_data)
+    if not ids:
+        response_utils.add_result(response, "There is no `ids` to make links")
+        return response
+
+    parameters = connections.get_semantic_search_parameters(ids, paper_id)
+    if not parameters:
+        response_utils.add_result(
+            response, "There is no `parameters` to make links")
+        return response
+
+    papers = recommender.compare_papers(**parameters)
+    if not papers:
+        response_utils.add_result(response, "Not found paper links")
+        return response
+
+    # conexões inversas: de cada paper avaliado para o paper principal
+    add_connections_by_semantic_similarity([
+        (evaluated_paper['paper_id'], paper_id, evaluated_paper['score'])
+        for evaluated_paper in papers['evaluated']
+    ])
+
+    return connections.register_papers_connections(
+        paper_id, papers['evaluated'], papers['cut'])
+
+
 def add_connection_by_semantic_similarity(paper_id, connected_paper_id, score):
-    paper = get_paper_by_record_id(paper_id)
-    paper.add_connection(connected_paper_id, score)
-    paper.save()
+    return add_connections_by_semantic_similarity(
+        [(paper_id, connected_paper_id, score)])
+
+
+def add_connections_by_semantic_similarity(items):
+    """
+    Adiciona / substitui conexões em lote (`connections.push_connections`)
+
+    Parameters
+    ----------
+    items: list
+        (paper_id, connected_paper_id, score)
+
+    Returns
+    -------
+    dict
+    """
+    response = response_utils.create_response(
+        "add_connections_by_semantic_similarity")
+
+    added, not_registered = connections.push_connections(items)
+    for connected_paper_id in not_registered:
+        response_utils.add_result(
+            response, "not registered: %s" % connected_paper_id)
+    response["connections"] = added
+    return response
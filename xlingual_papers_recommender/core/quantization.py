@@ -0,0 +1,165 @@
+"""
+Formatos compactos para os vetores normalizados (L2) dos papers:
+
+- float32: 4 bytes por dimensão
+- float16: 2 bytes por dimensão
+- int8: 1 byte por dimensão e uma escala (float32) por vetor,
+  vetor ~= valores int8 * escala
+
+Como os vetores são normalizados, o score (cosseno) é o produto escalar,
+calculado diretamente sobre a matriz compacta, em blocos.
+"""
+import heapq
+
+import numpy as np
+
+
+DTYPES = ("float32", "float16", "int8")
+
+_CHUNK_SIZE = 10000
+
+
+def quantize(vectors, dtype):
+    """
+    Parameters
+    ----------
+    vectors: numpy.ndarray
+        float32, shape (n, dim)
+    dtype: str
+        float32, float16, int8
+
+    Returns
+    -------
+    tuple
+        (numpy.ndarray, numpy.ndarray ou None)
+        matriz no formato `dtype` e escalas (somente para int8)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype not in DTYPES:
+        raise ValueError("dtype must be one of %s" % str(DTYPES))
+    if dtype != "int8":
+        return vectors.astype(dtype), None
+    scales = np.abs(vectors).max(axis=-1) / 127
+    scales[scales == 0] = 1
+    values = np.rint(vectors / scales[..., np.newaxis])
+    return values.astype(np.int8), scales.astype(np.float32)
+
+
+def dequantize(values, scales=None):
+    values = np.asarray(values, dtype=np.float32)
+    if scales is None:
+        return values
+    return values * np.asarray(scales, dtype=np.float32)[..., np.newaxis]
+
+
+def dot_scores(query_vector, values, scales=None):
+    """
+    Produto escalar entre o vetor e cada linha da matriz compacta
+
+    Parameters
+    ----------
+    query_vector: numpy.ndarray
+        float32, shape (dim, )
+    values: numpy.ndarray
+        float32, float16 ou int8, shape (n, dim)
+    scales: numpy.ndarray
+        escalas das linhas (somente para int8)
+
+    Returns
+    -------
+    numpy.ndarray
+        float32, shape (n, )
+    """
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    scores = np.empty(len(values), dtype=np.float32)
+    for start in range(0, len(values), _CHUNK_SIZE):
+        end = start + _CHUNK_SIZE
+        # numpy não tem produto de matrizes otimizado para float16 / int8
+        scores[start:end] = values[start:end].astype(np.float32) @ query_vector
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def top_k(scores, k):
+    """
+    Índices dos `k` maiores scores, em ordem decrescente de score
+    """
+    k = min(k, len(scores))
+    if not k:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class RunningTopK:
+    """
+    Mantém os `k` maiores scores (com score >= `min_score`) de scores
+    recebidos em blocos, usando um heap de tamanho `k`
+    """
+
+    def __init__(self, k=None, min_score=None):
+        self.k = k
+        self.min_score = min_score
+        self._heap = []
+        self._count = 0
+
+    def push(self, scores, items):
+        """
+        Parameters
+        ----------
+        scores: numpy.ndarray
+        items: list
+            item correspondente a cada score
+        """
+        indexes = np.arange(len(scores))
+        if self.min_score is not None:
+            indexes = indexes[scores >= self.min_score]
+        if self.k and len(indexes) > self.k:
+            indexes = indexes[top_k(scores[indexes], self.k)]
+        for i in indexes:
+            # _count desempata scores iguais
+            entry = (float(scores[i]), self._count, items[i])
+            self._count += 1
+            if not self.k or len(self._heap) < self.k:
+                heapq.heappush(self._heap, entry)
+            elif entry > self._heap[0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def results(self):
+        """
+        Returns
+        -------
+        list
+            (item, score) em ordem decrescente de score
+        """
+        return [
+            (item, score)
+            for score, count, item in sorted(self._heap, reverse=True)
+        ]
+
+
+def recall_at_k(vectors, dtype, k=10, n_queries=100, seed=0):
+    """
+    Compara os `k` mais similares obtidos com os vetores no formato `dtype`
+    com os obtidos com os vetores float32, usando como consulta uma amostra
+    dos próprios vetores
+
+    Returns
+    -------
+    float
+        proporção média dos `k` mais similares recuperados
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    values, scales = quantize(vectors, dtype)
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    found = 0
+    for i in queries:
+        expected = set(top_k(dot_scores(vectors[i], vectors), k))
+        got = set(top_k(dot_scores(vectors[i], values, scales), k))
+        found += len(expected & got) / len(expected)
+    return found / len(queries)
@@ -1,10 +1,12 @@
 from xlingual_papers_recommender.core import (
-    semantics,
+    embeddings,
+    quantization,
 )
-from xlingual_papers_recommender import configuration
+from xlingual_papers_recommender import configuration, exceptions
 
 
-def compare_papers(text, ids, texts):
+def compare_papers(text, ids, texts, paper_id=None, model_name=None,
+                   top_k=None, min_score=None):
     """
     Atribui `score` de similaridade
     Parameters
@@ -12,23 +14,72 @@ def compare_papers(text, ids, texts):
     text: str
         texto principal
     ids: str list
-        ids dos papers para comparar
+        ids dos papers para comparar, em ordem de prioridade
+        (por exemplo, os que compartilham mais referências primeiro);
+        os primeiros têm prioridade para serem processados pelo modelo
     texts: str list
         textos dos papers para comparar
+    paper_id: str
+        id do paper do texto principal (opcional),
+        permite usar o vetor armazenado do texto principal
+    model_name: str
+        nome do modelo (opcional), o padrão é `configuration.DEFAULT_MODEL`
+    top_k: int
+        quantidade máxima de papers avaliados,
+        o padrão é `configuration.TOP_K`
+    min_score: float
+        score mínimo dos papers avaliados,
+        o padrão é `configuration.MIN_SCORE`
 
     Returns
     -------
     list
         dict keys: paper_id, score
     """
+    if not text:
+        raise exceptions.InsuficientArgumentsToSearchDocumentError(
+            "recommender.compare_papers requires text parameter"
+        )
+
     # se necessario
     # reduz a quantidade de candidatos para minimizar problemas de desempenho
     cut = []
-    if len(ids) > configuration.MAX_CANDIDATES:
-        cut = ids[:-configuration.MAX_CANDIDATES]
-        ids = ids[-configuration.MAX_CANDIDATES:]
-        texts = texts[-configuration.MAX_CANDIDATES:]
-        # ids = controller.get_most_recent_paper_ids(ids)[:configuration.MAX_CANDIDATES]
+    if len(ids) > configuration.MAX_SCORED_CANDIDATES:
+        cut = list(ids[configuration.MAX_SCORED_CANDIDATES:])
+        ids = ids[:configuration.MAX_SCORED_CANDIDATES]
+        texts = texts[:configuration.MAX_SCORED_CANDIDATES]
+
+    if min_score is None:
+        min_score = configuration.MIN_SCORE
+    query_vector = embeddings.get_vector(text, paper_id, model_name)
+    ranking = quantization.RunningTopK(top_k or configuration.TOP_K, min_score)
+
+    # compara os candidatos em blocos, com os vetores armazenados;
+    # somente MAX_CANDIDATES textos sem vetor armazenado são processados
+    # pelo modelo, os demais candidatos sem vetor ficam em `cut`
+    max_encoded = configuration.MAX_CANDIDATES
+    chunk_size = configuration.SCORE_CHUNK_SIZE
+    for start in range(0, len(ids), chunk_size):
+        chunk_ids = ids[start:start + chunk_size]
+        positions, vectors, encoded = embeddings.get_available_vectors(
+            chunk_ids, texts[start:start + chunk_size], model_name,
+            max_encoded,
+        )
+        max_encoded -= encoded
+        if len(positions) < len(chunk_ids):
+            available = set(positions)
+            cut.extend(
+                paper_id for i, paper_id in enumerate(chunk_ids)
+                if i not in available
+            )
+        if positions:
+            ranking.push(
+                quantization.dot_scores(query_vector, vectors),
+                [chunk_ids[i] for i in positions],
+            )
 
-    evaluated = semantics.compare_texts(text, ids, texts)
+    evaluated = [
+        {'score': score, 'paper_id': paper_id}
+        for paper_id, score in ranking.results()
+    ]
     return {"evaluated": evaluated, "cut": cut}
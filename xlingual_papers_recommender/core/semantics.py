@@ -1,13 +1,26 @@
 import os
+import gc
+import time
+import resource
+import threading
+from collections import OrderedDict
 
-from sentence_transformers import SentenceTransformer
-from sentence_transformers.util import semantic_search
+import numpy as np
 
-from xlingual_papers_recommender import configuration
+from xlingual_papers_recommender import configuration, exceptions
+from xlingual_papers_recommender.core import batching, quantization
+
+# sentence_transformers (e torch) são importados somente quando o modelo
+# é usado, assim quem não compara textos não paga pelo tempo de importação
 
 
 _MODELS_PATH = configuration.MODELS_PATH
 _DEFAULT_MODEL = configuration.DEFAULT_MODEL
+_INFERENCE_BACKEND = configuration.INFERENCE_BACKEND
+_AVAILABLE_MODELS = tuple(OrderedDict.fromkeys(
+    configuration.MODELS +
+    [_DEFAULT_MODEL, configuration.SEARCH_PAPERS_MODEL]
+))
 
 
 def _get_model_path(model_name):
@@ -23,43 +36,311 @@ def _get_sentence_transformer(model_name_or_path=None):
         _DEFAULT_MODEL
     )
     print("Usando %s" % model_name_or_path)
+    from sentence_transformers import SentenceTransformer
     return SentenceTransformer(model_name_or_path)
 
 
-_SENTENCE_TRANSFORMER = _get_sentence_transformer()
-print(_SENTENCE_TRANSFORMER)
+def _get_rss_mb():
+    """
+    Memória residente do processo, em MB
+    """
+    try:
+        with open("/proc/self/statm") as fp:
+            pages = int(fp.read().split()[1])
+        return pages * resource.getpagesize() / 1024 / 1024
+    except (IOError, IndexError, ValueError):
+        # maior valor atingido, em KB (Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ModelHolder:
+    """
+    Mantém o modelo, que é carregado somente quando usado pela primeira vez.
+
+    `preload` permite carregá-lo antecipadamente, por exemplo, no processo
+    principal do Celery antes do fork, assim os processos filhos compartilham
+    os pesos do modelo (copy-on-write)
+    """
+
+    def __init__(self, model_name, backend=None):
+        self.model_name = model_name
+        self.backend = backend or _INFERENCE_BACKEND
+        self.load_seconds = None
+        self.rss_delta_mb = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._load()
+        return self._model
+
+    def unload(self):
+        with self._lock:
+            self._model = None
+        gc.collect()
+
+    @property
+    def size_mb(self):
+        """
+        Memória ocupada pelo modelo, em MB
+        """
+        if not self.loaded:
+            return 0
+        return max(self.rss_delta_mb or 0, self.stats()["parameters_mb"])
+
+    def _load(self):
+        rss = _get_rss_mb()
+        start = time.time()
+        model = _get_sentence_transformer(
+            _get_model_path(self.model_name) or self.model_name)
+
+        from xlingual_papers_recommender.core import inference_backends
+        self._model = inference_backends.apply_backend(
+            model, self.backend,
+            os.path.join(configuration.ONNX_PATH, self.model_name + ".onnx"),
+            configuration.TORCH_NUM_THREADS,
+        )
+        self.load_seconds = time.time() - start
+        self.rss_delta_mb = _get_rss_mb() - rss
+        print(self.stats())
+
+    def stats(self):
+        data = {
+            "model_name": self.model_name,
+            "backend": self.backend,
+            "loaded": self.loaded,
+            "load_seconds": self.load_seconds,
+            "rss_delta_mb": self.rss_delta_mb,
+            "rss_mb": _get_rss_mb(),
+        }
+        if self.loaded:
+            data["parameters_mb"] = sum(
+                p.numel() * p.element_size()
+                for p in self._model.parameters()
+            ) / 1024 / 1024
+        return data
+
+
+class ModelRegistry:
+    """
+    Mantém vários modelos em um mesmo processo, carregados quando usados.
+    Se a memória ocupada pelos modelos carregados ultrapassa `memory_budget_mb`,
+    os modelos usados há mais tempo são descarregados (LRU)
+    """
+
+    def __init__(self, memory_budget_mb=None):
+        self.memory_budget_mb = memory_budget_mb
+        self._holders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_holder(self, model_name=None):
+        model_name = get_model_name(model_name)
+        with self._lock:
+            try:
+                holder = self._holders[model_name]
+            except KeyError:
+                holder = self._holders[model_name] = ModelHolder(model_name)
+            self._holders.move_to_end(model_name)
+        return holder
+
+    def get(self, model_name=None):
+        holder = self.get_holder(model_name)
+        loaded = holder.loaded
+        model = holder.get()
+        if not loaded:
+            self._evict(holder)
+        return model
+
+    def _evict(self, keep):
+        if not self.memory_budget_mb:
+            return
+        with self._lock:
+            loaded = [h for h in self._holders.values() if h.loaded]
+            total = sum(h.size_mb for h in loaded)
+            for holder in loaded:
+                if total <= self.memory_budget_mb:
+                    break
+                if holder is keep:
+                    continue
+                total -= holder.size_mb
+                print("Descarregando %s" % holder.model_name)
+                holder.unload()
+
+    def stats(self):
+        return [holder.stats() for holder in self._holders.values()]
+
+
+_MODELS = ModelRegistry(configuration.MODELS_MEMORY_BUDGET_MB)
+
 
+def preload(model_name=None):
+    """
+    Carrega o modelo antecipadamente
+    """
+    _MODELS.get(model_name)
+    return _MODELS.get_holder(model_name).stats()
 
-def _gen_vectors(sentences, convert_to_tensor=True):
-    print(">>> _gen_vectors")
-    print(len(sentences))
-    return _SENTENCE_TRANSFORMER.encode(
-        sentences, convert_to_tensor=convert_to_tensor)
 
+def get_model_stats():
+    return _MODELS.stats()
 
-def _search(text, texts):
-    print(">>> _search %s" % text)
-    print(len(texts))
 
-    # based on https://github.com/UKPLab/sentence-transformers/blob/master/examples/applications/semantic-search/semantic_search_publications.py
-    query_embedding = _gen_vectors(text)
+def _model_encode(sentences, model_name=None):
+    return _MODELS.get(model_name).encode(
+        sentences, convert_to_numpy=True,
+        batch_size=configuration.ENCODE_BATCH_MAX_SIZE,
+    )
+
 
-    corpus_embeddings = _gen_vectors(texts)
+# model_name -> batching.EncodeBatcher
+_BATCHERS = {}
 
-    print("Inicio semantic_search")
-    search_hits = semantic_search(query_embedding, corpus_embeddings)
-    print("Fim semantic_search")
 
+def _get_batcher(model_name):
     try:
-        # Get the hits for the first query
-        return search_hits[0]
-    except IndexError:
-        return
-
-
-def compare_texts(text, ids, texts):
-    ranking = []
-    for found_item in _search(text, texts):
-        index = found_item['corpus_id']
-        ranking.append({'score': found_item['score'], 'paper_id': ids[index]})
-    return ranking
+        return _BATCHERS[model_name]
+    except KeyError:
+        return _BATCHERS.setdefault(
+            model_name,
+            batching.EncodeBatcher(
+                lambda sentences: _model_encode(sentences, model_name),
+                configuration.ENCODE_BATCH_MAX_SIZE,
+                configuration.ENCODE_BATCH_MAX_WAIT_MS,
+            )
+        )
+
+
+def _encode(sentences, model_name=None):
+    """
+    Gera os vetores de `sentences` (lista de textos),
+    agrupando as chamadas concorrentes, se configurado
+    """
+    model_name = get_model_name(model_name)
+    if configuration.ENCODE_MICRO_BATCHING:
+        return _get_batcher(model_name).encode(sentences)
+    return _model_encode(sentences, model_name)
+
+
+def get_model_name(model_name=None):
+    """
+    Retorna `model_name` (ou o modelo padrão) se é um dos modelos configurados
+
+    Raises
+    ------
+    exceptions.UnknownModelError
+    """
+    if not model_name:
+        return _DEFAULT_MODEL
+    if model_name not in _AVAILABLE_MODELS:
+        raise exceptions.UnknownModelError(
+            "Unknown model: %s. Expected one of: %s" %
+            (model_name, ", ".join(_AVAILABLE_MODELS))
+        )
+    return model_name
+
+
+def normalize(vectors):
+    """
+    Normaliza (L2) os vetores, assim o produto escalar equivale ao cosseno
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def encode(sentences, model_name=None):
+    """
+    Gera os vetores normalizados de `sentences`
+
+    Parameters
+    ----------
+    sentences: str list
+    model_name: str
+
+    Returns
+    -------
+    numpy.ndarray
+        float32, shape (len(sentences), dimensão do modelo)
+    """
+    return normalize(_encode(sentences, model_name))
+
+
+def _get_padding_ratio(lengths, batch_size):
+    """
+    Proporção de tokens de preenchimento (padding) quando `lengths` são
+    processados em lotes de `batch_size`, na ordem dada
+    """
+    padded = 0
+    for start in range(0, len(lengths), batch_size):
+        batch = lengths[start:start + batch_size]
+        padded += max(batch) * len(batch)
+    if not padded:
+        return 0
+    return (padded - sum(lengths)) / padded
+
+
+def encode_by_length(sentences, batch_size=None, model_name=None):
+    """
+    Gera os vetores normalizados de `sentences` agrupando textos de
+    quantidade de tokens semelhante, para reduzir o preenchimento (padding)
+    dos lotes. Os textos são tokenizados uma só vez, ordenados por
+    quantidade de tokens e os vetores são devolvidos na ordem original.
+    Indicado para gerar os vetores de muitos papers de uma vez
+
+    Parameters
+    ----------
+    sentences: str list
+    batch_size: int
+    model_name: str
+
+    Returns
+    -------
+    tuple
+        numpy.ndarray, dict (padding_ratio, unsorted_padding_ratio, tokens)
+    """
+    import torch
+
+    batch_size = batch_size or configuration.ENCODE_BATCH_MAX_SIZE
+    model = _MODELS.get(model_name)
+    tokenizer = model.tokenizer
+    input_ids = tokenizer(
+        list(sentences),
+        truncation=True,
+        max_length=model.get_max_seq_length(),
+    )["input_ids"]
+    lengths = [len(ids) for ids in input_ids]
+    order = sorted(range(len(sentences)), key=lambda i: lengths[i])
+
+    vectors = None
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        features = tokenizer.pad(
+            {"input_ids": [input_ids[i] for i in batch]},
+            return_tensors="pt",
+        )
+        features = {k: v.to(model.device) for k, v in features.items()}
+        with torch.no_grad():
+            embeddings = model(features)["sentence_embedding"].cpu().numpy()
+        if vectors is None:
+            vectors = np.empty(
+                (len(sentences), embeddings.shape[1]), dtype=np.float32)
+        vectors[batch] = embeddings
+
+    stats = {
+        "tokens": sum(lengths),
+        "padding_ratio": _get_padding_ratio(
+            [lengths[i] for i in order], batch_size),
+        "unsorted_padding_ratio": _get_padding_ratio(lengths, batch_size),
+    }
+    if vectors is None:
+        return np.empty((0, 0), dtype=np.float32), stats
+    return normalize(vectors), stats
+
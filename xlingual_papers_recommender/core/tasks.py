@@ -1,11 +1,17 @@
 import logging
 
-from celery import Celery
+from celery import Celery, chain
+from celery.signals import worker_init
 
 from xlingual_papers_recommender.db.data_models import PROC_STATUS_TODO
 from xlingual_papers_recommender.utils import response_utils
-from xlingual_papers_recommender.core import papers, connections, recommender
+from xlingual_papers_recommender.core import (
+    papers, connections, recommender, semantics, vector_index,
+)
 from xlingual_papers_recommender.configuration import (
+    PRELOAD_MODEL,
+    SEARCH_PAPERS_BY_VECTOR_INDEX,
+    SEARCH_PAPERS_MODEL,
     CELERY_BROKER_URL,
     CELERY_RESULT_BACKEND_URL,
     PAPERS_REGISTRATION_QUEUE,
@@ -17,6 +23,7 @@ from xlingual_papers_recommender.configuration import (
     COMPARE_PAPERS_QUEUE,
     REGISTER_PAPERS_CONNECTIONS_QUEUE,
     ADD_CONNECTION_QUEUE,
+    LINKS_PIPELINE,
     REGISTER_ROW_QUEUE,
     JOIN_CSV_QUEUE,
     REGISTER_JSON_QUEUE,
@@ -30,6 +37,17 @@ app = Celery('tasks', backend=CELERY_RESULT_BACKEND_URL, broker=CELERY_BROKER_UR
 LOGGER = logging.getLogger(__name__)
 
 
+@worker_init.connect
+def preload_model(**kwargs):
+    # executado no processo principal, antes do fork dos processos filhos
+    if PRELOAD_MODEL:
+        LOGGER.info("Preloaded model: %s", semantics.preload())
+    if SEARCH_PAPERS_BY_VECTOR_INDEX:
+        # índice gerado por build_index, lido por memory map
+        state = vector_index.load_index(SEARCH_PAPERS_MODEL)
+        LOGGER.info("Loaded vector index: %s", state["version"])
+
+
 def get_queue(registered_paper):
     refs = registered_paper.references
     if len(refs) > 100:
@@ -45,6 +63,7 @@ def _handle_result(task_name, result, get_result):
 
     response = response_utils.create_response(task_name)
     response['get_result'] = get_result
+    response['task_id'] = result.id
     return response
 
 
@@ -112,63 +131,142 @@ def task_add_referenced_by_to_source(ref, paper_id, MARK, pid, year, subject_are
     return connections.add_referenced_by_to_source(ref, paper_id, MARK, pid, year, subject_areas)
 
 
-###########################################
+def add_references_to_sources(refs, paper_id, pid, year, subject_areas, get_result=None):
+    MARK = PROC_STATUS_TODO
+    res = task_add_references_to_sources.apply_async(
+        queue=SOURCES_REGISTRATION_QUEUE,
+        args=(refs, paper_id, MARK, pid, year, subject_areas)
+    )
+    return _handle_result("task add_references_to_sources", res, get_result)
 
-# def find_and_create_connections(paper_id, get_result=None):
-#     # print("find_and_create_connections", paper_id)
-#     res = task_find_and_create_connections.apply_async(
-#         queue=LINKS_REGISTRATION_QUEUE, args=(paper_id, ))
-#     return _handle_result(
-#         "task find_and_create_connections", res, get_result)
 
+@app.task()
+def task_add_references_to_sources(refs, paper_id, MARK, pid, year, subject_areas):
+    return connections.add_references_to_sources(refs, paper_id, MARK, pid, year, subject_areas)
 
-# @app.task()
-# def task_find_and_create_connections(paper_id):
-#     # # print("task.task_find_and_create_connections")
-#     return connections.find_and_create_connections(paper_id)
 
+###########################################
 
 def find_and_create_connections(paper_id, get_result=None):
-    response = response_utils.create_response("find_and_create_connections")
-    paper_data = get_parameters_to_get_ids_connected_by_references(
-        paper_id, get_result=True
+    """
+    Executa as etapas da criação das conexões do paper como uma cadeia
+    (celery chain) de tarefas ou, se `LINKS_PIPELINE` é "fused", em uma
+    só tarefa, sem bloquear o processo que a chama.
+    O resultado (ou o `task_id` para consultar `get_task_status`)
+    é o de `register_papers_connections`
+    """
+    if LINKS_PIPELINE == 'fused':
+        return find_and_create_connections_in_one_task(paper_id, get_result)
+    res = get_find_and_create_connections_chain(paper_id).apply_async()
+    return _handle_result("task find_and_create_connections", res, get_result)
+
+
+def find_and_create_connections_in_one_task(paper_id, get_result=None):
+    res = task_find_and_create_connections.apply_async(
+        queue=LINKS_REGISTRATION_QUEUE, args=(paper_id, ))
+    return _handle_result(
+        "task find_and_create_connections", res, get_result)
+
+
+@app.task()
+def task_find_and_create_connections(paper_id):
+    return papers.find_and_create_connections(paper_id)
+
+
+def get_find_and_create_connections_chain(paper_id):
+    return chain(
+        task_get_parameters_to_get_ids_connected_by_references.si(
+            paper_id).set(queue=PAPERS_GET_QUEUE),
+        task_links_get_ids_connected_by_references.s(
+            paper_id).set(queue=GET_IDS_CONNECTED_BY_REFERENCES_QUEUE),
+        task_links_get_semantic_search_parameters.s(
+            paper_id).set(queue=GET_SEMANTIC_SEARCH_PARAMETERS_QUEUE),
+        task_links_compare_papers.s(
+            paper_id).set(queue=COMPARE_PAPERS_QUEUE),
+        task_links_register_papers_connections.s(
+            paper_id).set(queue=REGISTER_PAPERS_CONNECTIONS_QUEUE),
     )
-    if not paper_data:
-        response_utils.add_result(
-            response, "Do nothing. Paper status is not PROC_STATUS_TODO")
-        return response
 
-    paper_data['get_result'] = True
-    ids = get_ids_connected_by_references(**paper_data)
-    if not ids:
-        response_utils.add_result(response, "There is no `ids` to make links")
-        return response
 
-    parameters = get_semantic_search_parameters(ids, paper_id, get_result=True)
-    if not parameters:
-        response_utils.add_result(
-            response, "There is no `parameters` to make links")
-        return response
+def _stop_links(message):
+    # interrompe a cadeia: as etapas seguintes somente repassam a resposta
+    response = response_utils.create_response("find_and_create_connections")
+    response_utils.add_result(response, message)
+    response['stopped'] = True
+    return response
 
-    parameters['get_result'] = True
-    papers = compare_papers(**parameters)
-    if not papers:
-        response_utils.add_result(response, "Not found paper links")
-        return response
 
-    for evaluated_paper in papers['evaluated']:
-        add_connection_by_semantic_similarity(
-            evaluated_paper['paper_id'], paper_id, evaluated_paper['score'],
-        )
+def _is_stopped(data):
+    return isinstance(data, dict) and data.get('stopped')
+
 
-    result = register_papers_connections(
+@app.task()
+def task_links_get_ids_connected_by_references(paper_data, paper_id):
+    if _is_stopped(paper_data):
+        return paper_data
+    if not paper_data:
+        return _stop_links("Do nothing. Paper status is not PROC_STATUS_TODO")
+    return connections.get_ids_connected_by_references(
         paper_id,
-        papers['evaluated'],
-        papers['cut'],
-        get_result=get_result,
+        paper_data.get('subject_areas'),
+        paper_data.get('from_year'),
+        paper_data.get('to_year'),
+    ) or _stop_links("There is no `ids` to make links")
+
+
+@app.task()
+def task_links_get_semantic_search_parameters(ids, paper_id):
+    if _is_stopped(ids):
+        return ids
+    return (
+        connections.get_semantic_search_parameters(ids, paper_id) or
+        _stop_links("There is no `parameters` to make links")
     )
 
-    return result
+
+@app.task()
+def task_links_compare_papers(parameters, paper_id):
+    if _is_stopped(parameters):
+        return parameters
+    return (
+        recommender.compare_papers(**parameters) or
+        _stop_links("Not found paper links")
+    )
+
+
+@app.task()
+def task_links_register_papers_connections(papers, paper_id):
+    if _is_stopped(papers):
+        return papers
+
+    # conexões inversas: de cada paper avaliado para o paper principal,
+    # em uma tarefa (um bulk_write), sem aguardar o resultado
+    if papers['evaluated']:
+        add_connections_by_semantic_similarity([
+            (evaluated_paper['paper_id'], paper_id, evaluated_paper['score'])
+            for evaluated_paper in papers['evaluated']
+        ])
+
+    return connections.register_papers_connections(
+        paper_id, papers['evaluated'], papers['cut'])
+
+
+def get_task_status(task_id):
+    """
+    Consulta a situação de uma tarefa (ou da cadeia de tarefas) pelo `task_id`
+    obtido na resposta das funções chamadas sem `get_result`.
+    Requer um result backend persistente (`rpc://` somente entrega o
+    resultado ao processo que criou a tarefa)
+    """
+    res = app.AsyncResult(task_id)
+    response = response_utils.create_response("get_task_status")
+    response['task_id'] = task_id
+    response['status'] = res.status
+    if res.successful():
+        response['result'] = res.result
+    elif res.failed():
+        response_utils.add_exception(response, res.result)
+    return response
 
 ###########################################
 
@@ -189,6 +287,19 @@ def task_add_connection_by_semantic_similarity(paper_id, connected_paper_id, sco
         paper_id, connected_paper_id, score)
 
 
+def add_connections_by_semantic_similarity(items, get_result=None):
+    res = task_add_connections_by_semantic_similarity.apply_async(
+        queue=ADD_CONNECTION_QUEUE,
+        args=(items, ))
+    return _handle_result(
+        "task add_connections_by_semantic_similarity", res, get_result)
+
+
+@app.task()
+def task_add_connections_by_semantic_similarity(items):
+    return papers.add_connections_by_semantic_similarity(items)
+
+
 ###########################################
 
 
@@ -267,20 +378,23 @@ def task_get_semantic_search_parameters(ids, paper_id):
 ###########################################
 
 
-def compare_papers(text, ids, texts, get_result=None):
+def compare_papers(text, ids, texts, paper_id=None, model_name=None,
+                   top_k=None, min_score=None, get_result=None):
     # print("compare_papers")
     res = task_compare_papers.apply_async(
         queue=COMPARE_PAPERS_QUEUE,
-        args=(text, ids, texts)
+        args=(text, ids, texts, paper_id, model_name, top_k, min_score)
     )
     return _handle_result(
         "task compare_papers", res, get_result)
 
 
 @app.task()
-def task_compare_papers(text, ids, texts):
+def task_compare_papers(text, ids, texts, paper_id=None, model_name=None,
+                        top_k=None, min_score=None):
     # # print("task.task_compare_papers")
-    return recommender.compare_papers(text, ids, texts)
+    return recommender.compare_papers(
+        text, ids, texts, paper_id, model_name, top_k, min_score)
 
 
 ###########################################
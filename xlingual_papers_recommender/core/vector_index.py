@@ -0,0 +1,537 @@
+"""
+Índice de vetores (IVF-flat) sobre os vetores dos papers registrados,
+usado para responder uma busca por texto livre com os k papers mais
+similares, sem busca textual no MongoDB nem expansão por referências.
+
+Os vetores são agrupados por k-means em `nlist` listas (centróides);
+a busca compara o texto somente com os vetores das `nprobe` listas
+mais próximas. Enquanto há poucos vetores, a busca é exata (uma só lista).
+
+O índice é gerado fora do atendimento das buscas (`build_index`, por
+exemplo, `xlingual_papers_recommender_embeddings build_index`) e gravado em
+`configuration.VECTOR_INDEX_PATH`, com os vetores de cada lista contíguos.
+Os processos leem o índice gravado por memory map, somente leitura
+(`IVFFlatFile`), compartilhando o cache de páginas. Os vetores armazenados
+depois da geração do índice são acrescentados, de forma incremental, a um
+pequeno índice em memória (`IVFFlatIndex`) de cada processo, até a próxima
+geração.
+"""
+import os
+import json
+import time
+import shutil
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from xlingual_papers_recommender import configuration
+from xlingual_papers_recommender.core import (
+    semantics, embeddings, quantization,
+)
+from xlingual_papers_recommender.db.data_models import Paper
+from xlingual_papers_recommender.utils import files_utils
+
+
+_CHUNK_SIZE = 10000
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _assign(vectors, centroids):
+    """
+    Retorna o índice do centróide mais próximo de cada vetor
+    """
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _CHUNK_SIZE):
+        # a escala (positiva) de cada vetor não altera o centróide escolhido
+        chunk = vectors[start:start + _CHUNK_SIZE].astype(np.float32)
+        assignments[start:start + _CHUNK_SIZE] = np.argmax(
+            chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors, nlist, iterations=10, seed=0):
+    """
+    k-means esférico (vetores normalizados, similaridade por produto escalar)
+    """
+    rng = np.random.default_rng(seed)
+    nlist = min(nlist, len(vectors))
+    centroids = vectors[
+        rng.choice(len(vectors), nlist, replace=False)].astype(np.float32)
+    for i in range(iterations):
+        assignments = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        # mantém o centróide anterior se a lista ficou vazia
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]
+        centroids = semantics.normalize(sums)
+    return centroids
+
+
+class IVFFlatIndex:
+    """
+    Os vetores são mantidos no formato `dtype` (float32, float16 ou int8),
+    e os scores são calculados diretamente sobre a matriz compacta
+    """
+
+    def __init__(self, dim, centroids=None, dtype="float32"):
+        self.dim = dim
+        self.dtype = dtype
+        self.centroids = None
+        self.ids = []
+        self.positions = {}
+        self._vectors = np.empty((1024, dim), dtype=dtype)
+        self._scales = np.ones(1024, dtype=np.float32)
+        self._years = np.empty(1024, dtype=np.int32)
+        self._deleted = np.zeros(1024, dtype=bool)
+        self._subject_areas = []
+        self._lists = [[]]
+        if centroids is not None:
+            self.set_centroids(centroids)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def vectors(self):
+        return self._vectors[:len(self.ids)]
+
+    def _grow(self):
+        capacity = len(self._vectors) * 2
+        for name in ("_vectors", "_scales", "_years", "_deleted"):
+            current = getattr(self, name)
+            grown = np.zeros((capacity, ) + current.shape[1:], current.dtype)
+            grown[:len(current)] = current
+            setattr(self, name, grown)
+
+    def _get_list_index(self, vector):
+        if self.centroids is None:
+            return 0
+        return int(np.argmax(self.centroids @ vector.astype(np.float32)))
+
+    def add(self, paper_id, vector, year, subject_areas):
+        """
+        Adiciona o vetor do paper, substituindo o anterior, se houver
+        """
+        previous = self.positions.get(paper_id)
+        if previous is not None:
+            self._deleted[previous] = True
+
+        position = len(self.ids)
+        if position == len(self._vectors):
+            self._grow()
+        values, scales = quantization.quantize([vector], self.dtype)
+        self._vectors[position] = values[0]
+        if scales is not None:
+            self._scales[position] = scales[0]
+        self._years[position] = year or 0
+        self._deleted[position] = False
+        self._subject_areas.append(frozenset(subject_areas or []))
+        self.ids.append(paper_id)
+        self.positions[paper_id] = position
+        self._lists[self._get_list_index(self._vectors[position])].append(
+            position)
+
+    def set_centroids(self, centroids):
+        """
+        Define os centróides e redistribui os vetores nas listas
+        """
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self._lists = [[] for i in range(len(self.centroids))]
+        if self.ids:
+            for position, list_index in enumerate(
+                    _assign(self.vectors, self.centroids)):
+                self._lists[list_index].append(position)
+
+    def train(self, nlist, max_sample=None, seed=0):
+        rng = np.random.default_rng(seed)
+        max_sample = max_sample or nlist * 64
+        sample = np.arange(len(self.ids))
+        if len(sample) > max_sample:
+            sample = np.sort(rng.choice(sample, max_sample, replace=False))
+        vectors = quantization.dequantize(
+            self._vectors[sample],
+            self._scales[sample] if self.dtype == "int8" else None,
+        )
+        self.set_centroids(train_centroids(vectors, nlist, seed=seed))
+
+    def _get_candidates(self, query_vector, nprobe):
+        if self.centroids is None:
+            lists = self._lists
+        else:
+            nprobe = min(nprobe, len(self.centroids))
+            scores = self.centroids @ query_vector
+            lists = [
+                self._lists[i]
+                for i in np.argpartition(-scores, nprobe - 1)[:nprobe]
+            ]
+        positions = np.fromiter(
+            (p for items in lists for p in items), dtype=np.int64)
+        return positions[~self._deleted[positions]]
+
+    def search(self, query_vector, top_k,
+               subject_areas=None, from_year=None, to_year=None,
+               nprobe=None):
+        """
+        Obtém os `top_k` papers mais similares ao vetor
+
+        Returns
+        -------
+        list
+            dict keys: paper_id, score
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        positions = self._get_candidates(
+            query_vector, nprobe or configuration.VECTOR_INDEX_NPROBE)
+
+        if from_year:
+            positions = positions[self._years[positions] >= int(from_year)]
+        if to_year:
+            positions = positions[self._years[positions] <= int(to_year)]
+        if subject_areas:
+            subject_areas = set(subject_areas)
+            positions = np.array(
+                [p for p in positions if subject_areas & self._subject_areas[p]],
+                dtype=np.int64,
+            )
+        if not len(positions):
+            return []
+
+        scores = quantization.dot_scores(
+            query_vector, self._vectors[positions],
+            self._scales[positions] if self.dtype == "int8" else None,
+        )
+        best = quantization.top_k(scores, top_k)
+        return [
+            {"paper_id": self.ids[positions[i]], "score": float(scores[i])}
+            for i in best
+        ]
+
+    def save(self, folder, since=None):
+        """
+        Grava o índice em `folder`, com os vetores de cada lista contíguos,
+        para ser lido por memory map (`IVFFlatFile`)
+        """
+        order = []
+        offsets = [0]
+        for items in self._lists:
+            order.extend(p for p in items if not self._deleted[p])
+            offsets.append(len(order))
+        order = np.array(order, dtype=np.int64)
+
+        # áreas temáticas de cada vetor como bits de um inteiro
+        subject_areas = sorted(set().union(*self._subject_areas))
+        if len(subject_areas) > 64:
+            raise ValueError(
+                "vector index supports up to 64 subject areas, found %i" %
+                len(subject_areas))
+        bits = {area: np.uint64(1) << np.uint64(i)
+                for i, area in enumerate(subject_areas)}
+        masks = np.zeros(len(order), dtype=np.uint64)
+        for i, position in enumerate(order):
+            for area in self._subject_areas[position]:
+                masks[i] |= bits[area]
+
+        files_utils.create_folder(folder)
+        arrays = {
+            "vectors": self._vectors[order],
+            "scales": self._scales[order],
+            "years": self._years[order],
+            "subject_areas": masks,
+            "ids": np.array([self.ids[p] for p in order], dtype=bytes),
+            "offsets": np.array(offsets, dtype=np.int64),
+        }
+        if self.centroids is not None:
+            arrays["centroids"] = self.centroids
+        for name, values in arrays.items():
+            np.save(os.path.join(folder, name + ".npy"), values)
+        files_utils.write_file(
+            os.path.join(folder, "meta.json"),
+            json.dumps({
+                "dim": self.dim,
+                "dtype": self.dtype,
+                "subject_areas": subject_areas,
+                "since": _dump_mark(since),
+            }),
+        )
+
+
+class IVFFlatFile:
+    """
+    Índice gravado por `IVFFlatIndex.save`, lido por memory map
+    (somente leitura), compartilhado pelos processos do host
+    """
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, "meta.json")) as fp:
+            meta = json.load(fp)
+        self.dim = meta["dim"]
+        self.dtype = meta["dtype"]
+        self.since = _load_mark(meta["since"])
+        self.subject_areas = {
+            area: np.uint64(1) << np.uint64(i)
+            for i, area in enumerate(meta["subject_areas"])
+        }
+
+        def read(name):
+            return files_utils.read_array(os.path.join(folder, name + ".npy"))
+
+        self._vectors = read("vectors")
+        self._scales = read("scales")
+        self._years = read("years")
+        self._masks = read("subject_areas")
+        self._ids = read("ids")
+        self._offsets = np.array(read("offsets"))
+        self.centroids = None
+        if os.path.isfile(os.path.join(folder, "centroids.npy")):
+            self.centroids = np.array(read("centroids"))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _get_candidates(self, query_vector, nprobe):
+        if self.centroids is None:
+            return np.arange(len(self._ids))
+        nprobe = min(nprobe, len(self.centroids))
+        scores = self.centroids @ query_vector
+        lists = np.sort(np.argpartition(-scores, nprobe - 1)[:nprobe])
+        # os vetores de cada lista são contíguos
+        return np.concatenate([
+            np.arange(self._offsets[i], self._offsets[i + 1]) for i in lists
+        ])
+
+    def search(self, query_vector, top_k,
+               subject_areas=None, from_year=None, to_year=None,
+               nprobe=None, exclude=None):
+        """
+        Obtém os `top_k` papers mais similares ao vetor
+
+        Parameters
+        ----------
+        exclude: set
+            ids dos papers que não devem ser retornados
+            (por exemplo, os que têm vetor mais recente)
+
+        Returns
+        -------
+        list
+            dict keys: paper_id, score
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        positions = self._get_candidates(
+            query_vector, nprobe or configuration.VECTOR_INDEX_NPROBE)
+
+        if from_year:
+            positions = positions[self._years[positions] >= int(from_year)]
+        if to_year:
+            positions = positions[self._years[positions] <= int(to_year)]
+        if subject_areas:
+            mask = np.uint64(0)
+            for area in subject_areas:
+                mask |= self.subject_areas.get(area, np.uint64(0))
+            positions = positions[(self._masks[positions] & mask) != 0]
+        if not len(positions):
+            return []
+
+        scores = quantization.dot_scores(
+            query_vector, self._vectors[positions],
+            self._scales[positions] if self.dtype == "int8" else None,
+        )
+        exclude = exclude or set()
+        items = []
+        for i in quantization.top_k(scores, top_k + len(exclude)):
+            paper_id = self._ids[positions[i]].decode("utf-8")
+            if paper_id not in exclude:
+                items.append({"paper_id": paper_id, "score": float(scores[i])})
+        return items[:top_k]
+
+
+def _dump_mark(mark):
+    # marca da última atualização incluída no índice:
+    # data (embeddings no MongoDB) ou linha (embeddings em arquivos)
+    if isinstance(mark, datetime):
+        return {"datetime": mark.isoformat()}
+    return {"row": None if mark is None else int(mark)}
+
+
+def _load_mark(data):
+    if data.get("datetime"):
+        return datetime.fromisoformat(data["datetime"])
+    return data.get("row")
+
+
+# model_name -> {"file": IVFFlatFile, "version": str,
+#                "delta": IVFFlatIndex, "since": ..., "refreshed": float}
+_INDEXES = {}
+
+
+def _get_index_folder(model_name):
+    return os.path.join(configuration.VECTOR_INDEX_PATH, model_name)
+
+
+def _read_current_version(model_name):
+    try:
+        with open(os.path.join(_get_index_folder(model_name), "CURRENT")) as fp:
+            return fp.read().strip() or None
+    except IOError:
+        return None
+
+
+def _get_papers_metadata(paper_ids):
+    """
+    Obtém ano de publicação e áreas temáticas dos papers em uma só consulta
+    """
+    records = Paper.objects(
+        pk__in=list(paper_ids)).only('pub_year', 'subject_areas').as_pymongo()
+    return {
+        str(record['_id']): (
+            record.get('pub_year'), record.get('subject_areas') or [])
+        for record in records
+    }
+
+
+def _get_nlist(total):
+    return (
+        configuration.VECTOR_INDEX_NLIST or
+        max(1, int(4 * np.sqrt(total)))
+    )
+
+
+def _add_updates(index, model_name, since, centroids=None):
+    """
+    Acrescenta a `index` os vetores armazenados depois de `since`
+
+    Returns
+    -------
+    tuple
+        (IVFFlatIndex ou None, marca da última atualização)
+    """
+    updates = embeddings.get_store().iter_updates(model_name, since)
+    while True:
+        batch = []
+        for item in updates:
+            batch.append(item)
+            if len(batch) == _CHUNK_SIZE:
+                break
+        if not batch:
+            break
+        metadata = _get_papers_metadata([item[0] for item in batch])
+        for paper_id, vector, mark in batch:
+            since = mark
+            if paper_id not in metadata:
+                continue
+            if index is None:
+                index = IVFFlatIndex(
+                    len(vector), centroids, configuration.VECTOR_INDEX_DTYPE)
+            index.add(paper_id, vector, *metadata[paper_id])
+    return index, since
+
+
+def build_index(model_name=None):
+    """
+    Gera o índice com todos os vetores armazenados (treina os centróides)
+    e o grava como a versão atual, que os processos passam a ler na próxima
+    atualização. Executado fora do atendimento das buscas
+    """
+    model_name = semantics.get_model_name(model_name)
+    index, since = _add_updates(None, model_name, None)
+    response = {"model_name": model_name, "vectors": len(index or [])}
+    if index is None:
+        return response
+    if len(index) >= configuration.VECTOR_INDEX_MIN_TRAIN_SIZE:
+        index.train(_get_nlist(len(index)))
+
+    folder = _get_index_folder(model_name)
+    version = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    index.save(os.path.join(folder, version), since)
+
+    current_path = os.path.join(folder, "CURRENT")
+    files_utils.write_file(current_path + ".tmp", version)
+    os.replace(current_path + ".tmp", current_path)
+
+    # os processos que leem as versões anteriores as mantêm abertas
+    for name in os.listdir(folder):
+        if name != version and os.path.isdir(os.path.join(folder, name)):
+            shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+
+    response["lists"] = len(index.centroids) if index.centroids is not None else 1
+    response["version"] = version
+    return response
+
+
+def load_index(model_name=None):
+    """
+    Abre a versão atual do índice gravado, se mudou, e acrescenta ao índice
+    em memória somente os vetores armazenados desde a última atualização
+    """
+    model_name = semantics.get_model_name(model_name)
+    state = _INDEXES.setdefault(
+        model_name,
+        {"file": None, "version": None, "delta": None, "since": None,
+         "refreshed": 0},
+    )
+    version = _read_current_version(model_name)
+    if version is None:
+        LOGGER.warning(
+            "No vector index for %s. Run build_index", model_name)
+    elif version != state["version"]:
+        index_file = IVFFlatFile(
+            os.path.join(_get_index_folder(model_name), version))
+        state.update({
+            "file": index_file, "version": version,
+            "delta": None, "since": index_file.since,
+        })
+    if state["file"] is not None:
+        state["delta"], state["since"] = _add_updates(
+            state["delta"], model_name, state["since"],
+            state["file"].centroids,
+        )
+    state["refreshed"] = time.time()
+    return state
+
+
+def get_index(model_name=None):
+    model_name = semantics.get_model_name(model_name)
+    state = _INDEXES.get(model_name)
+    if (state is None or time.time() - state["refreshed"] >
+            configuration.VECTOR_INDEX_REFRESH_SECONDS):
+        return load_index(model_name)
+    return state
+
+
+def search(text, top_k=None, subject_areas=None, from_year=None, to_year=None,
+           model_name=None):
+    """
+    Obtém os papers mais similares ao texto livre
+
+    Parameters
+    ----------
+    text: str
+    top_k: int
+    subject_areas: str list
+    from_year: int
+    to_year: int
+    model_name: str
+
+    Returns
+    -------
+    list
+        dict keys: paper_id, score
+    """
+    state = get_index(model_name)
+    if state["file"] is None:
+        return []
+    top_k = top_k or configuration.ITEMS_PER_PAGE
+    query_vector = embeddings.get_vector(text, model_name=model_name)
+
+    delta = state["delta"]
+    items = state["file"].search(
+        query_vector, top_k, subject_areas, from_year, to_year,
+        exclude=set(delta.positions) if delta is not None else None,
+    )
+    if delta is not None:
+        items.extend(delta.search(
+            query_vector, top_k, subject_areas, from_year, to_year))
+    return sorted(items, key=lambda item: -item["score"])[:top_k]
@@ -1,6 +1,9 @@
 from xlingual_papers_recommender.configuration import handle_text_s
-from xlingual_papers_recommender import exceptions
+from xlingual_papers_recommender import exceptions, configuration
+from xlingual_papers_recommender.utils.lru_cache import LRUCache
 
+import hashlib
+import unicodedata
 from datetime import datetime
 
 from mongoengine import (
@@ -13,6 +16,8 @@ from mongoengine import (
     DecimalField,
     IntField,
     DictField,
+    BinaryField,
+    FloatField,
 )
 
 """
@@ -38,6 +43,51 @@ def utcnow():
     return datetime.utcnow()
 
 
+def _normalize_fingerprint_value(value):
+    if value is None:
+        return ""
+    value = unicodedata.normalize("NFKD", str(value))
+    return "".join(
+        c for c in value.upper()
+        if c.isalnum() and not unicodedata.combining(c)
+    )
+
+
+def _normalize_doi(doi):
+    doi = doi.strip().lower()
+    for prefix in ("https://doi.org/", "http://doi.org/",
+                   "https://dx.doi.org/", "http://dx.doi.org/", "doi:"):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):].strip()
+    return doi.upper()
+
+
+def get_source_fingerprint(doi, pub_year, surname, organization_author,
+                           journal, source, vol):
+    """
+    Identificador canônico da fonte (`Source`):
+    DOI normalizado ou hash de ano, sobrenome do primeiro autor
+    (ou autor institucional), periódico (ou fonte) e volume normalizados
+
+    Returns
+    -------
+    str or None
+        None se não há dados suficientes
+    """
+    if doi and doi.strip():
+        return "DOI:" + _normalize_doi(doi)
+    try:
+        year = int(pub_year)
+    except (TypeError, ValueError):
+        return None
+    author = _normalize_fingerprint_value(surname or organization_author)
+    title = _normalize_fingerprint_value(journal or source)
+    if not author or not title:
+        return None
+    values = "|".join([str(year), author, title, _normalize_fingerprint_value(vol)])
+    return "REF:" + hashlib.sha1(values.encode("utf-8")).hexdigest()
+
+
 def paper_summary(obj):
     data = {
         "paper_id": obj._id,
@@ -73,15 +123,115 @@ def _paper_uri_params(paper):
     return {"url": url, "id": paper.pid}
 
 
-def _create_connection(paper, score=None):
+# paper _id -> dados do paper apresentados nas conexões
+_SUMMARIES = LRUCache(
+    configuration.PAPER_SUMMARIES_CACHE_SIZE,
+    configuration.PAPER_SUMMARIES_CACHE_SECONDS,
+)
+
+
+def get_connections_summaries(paper_ids):
+    """
+    Obtém os dados apresentados nas conexões dos papers,
+    os que não estão em cache em uma só consulta
+
+    Returns
+    -------
+    dict
+        paper _id -> dict keys: uri_params, doi_with_lang, uri,
+        paper_titles, abstracts
+    """
+    summaries = {}
+    missing = []
+    for _id in paper_ids:
+        summary = _SUMMARIES.get(_id)
+        if summary is None:
+            missing.append(_id)
+        else:
+            summaries[_id] = summary
+    if not missing:
+        return summaries
+
+    uri_params = {}
+    papers = Paper.objects(pk__in=list(set(missing))).only(
+        'pid', 'network_collection', 'uri', 'doi_with_lang',
+        'paper_titles', 'abstracts',
+    )
+    for paper in papers:
+        # url do site da coleção
+        if paper.network_collection not in uri_params:
+            uri_params[paper.network_collection] = _paper_uri_params(paper)
+        summary = {
+            "uri_params": dict(
+                uri_params[paper.network_collection], id=paper.pid),
+            "doi_with_lang": [item.as_dict() for item in paper.doi_with_lang],
+            "uri": [item.as_dict() for item in paper.uri],
+            "paper_titles": [item.as_dict() for item in paper.paper_titles],
+            "abstracts": [item.as_dict() for item in paper.abstracts],
+        }
+        summaries[paper._id] = summary
+        _SUMMARIES.set(paper._id, summary)
+    return summaries
+
+
+def _add_connections_summaries(items):
+    summaries = get_connections_summaries(
+        [item['paper_id'] for item in items])
+    for item in items:
+        item.update(summaries.get(item['paper_id']) or {})
+    return items
+
+
+def get_paper_connections(pid, min_score=None, limit=None, offset=None):
+    """
+    Obtém as conexões do paper, em ordem decrescente de score.
+    O filtro por `min_score` e a paginação (`offset`, `limit`)
+    são feitos pelo banco de dados (projeção com $filter e $slice)
+
+    Returns
+    -------
+    list
+        dict keys: paper_id, pid, pub_year, score, created, uri_params,
+        doi_with_lang, uri, paper_titles, abstracts
+
+    Raises
+    ------
+    exceptions.PaperNotFoundError
+    """
+    connections = '$connections'
+    if min_score:
+        connections = {'$filter': {
+            'input': '$connections',
+            'as': 'item',
+            'cond': {'$gte': ['$$item.score', float(min_score)]},
+        }}
+    limit = max(1, int(limit or configuration.MAX_CONNECTIONS))
+    pipeline = [
+        {'$project': {
+            '_id': 0,
+            'connections': {'$slice': [
+                {'$ifNull': [connections, []]}, int(offset or 0), limit]},
+        }},
+    ]
+    try:
+        record = list(Paper.objects(pid=pid).aggregate(pipeline))[0]
+    except IndexError:
+        raise exceptions.PaperNotFoundError("Not found paper: %s" % pid)
+    return _add_connections_summaries([
+        Connection._from_son(item).as_dict()
+        for item in record.get('connections') or []
+    ])
+
+
+def forget_connection_summary(paper_id):
+    _SUMMARIES.pop(str(paper_id))
+
+
+def create_connection(paper, score=None):
     item = Connection()
     item._id = paper._id
     item.pid = paper.pid
     item.pub_year = int(paper.pub_year)
-    item.uri = paper.uri
-    item.doi_with_lang = paper.doi_with_lang
-    item.paper_titles = paper.paper_titles
-    item.abstracts = paper.abstracts
     item.created = utcnow()
     if score:
         item.score = score
@@ -110,6 +260,15 @@ class RefLink(EmbeddedDocument):
         return self.to_json()
 
 
+def create_reflink(paper_id, pid, year, subject_areas):
+    reflink = RefLink()
+    reflink.paper_id = str(paper_id)
+    reflink.pid = pid
+    reflink.year = int(year)
+    reflink.subject_areas = subject_areas
+    return reflink
+
+
 class TextAndLang(EmbeddedDocument):
     lang = StringField()
     text = StringField()
@@ -235,25 +394,25 @@ class RelatedPaper(EmbeddedDocument):
 
 
 class Connection(EmbeddedDocument):
+    """
+    Os dados do paper conectado apresentados (uri, doi_with_lang,
+    paper_titles, abstracts) são obtidos no momento da leitura,
+    ver get_connections_summaries
+    """
     _id = StringField()
     pid = StringField()
     pub_year = IntField(required=True)
-    uri = EmbeddedDocumentListField(URI)
-    doi_with_lang = EmbeddedDocumentListField(DOI)
-    paper_titles = EmbeddedDocumentListField(TextAndLang)
-    abstracts = EmbeddedDocumentListField(TextAndLang)
     score = DecimalField()
     created = DateTimeField()
 
+    # conexões registradas antes tinham cópias dos dados do paper conectado
+    meta = {'strict': False}
+
     def as_dict(self):
         data = {
             "paper_id": self._id,
-            "uri_params": _paper_uri_params(self),
-            "doi_with_lang": [item.as_dict() for item in self.doi_with_lang],
-            "uri": [item.as_dict() for item in self.uri],
+            "pid": self.pid,
             "pub_year": self.pub_year,
-            "paper_titles": [item.as_dict() for item in self.paper_titles],
-            "abstracts": [item.as_dict() for item in self.abstracts],
         }
         if hasattr(self, 'score') and self.score:
             data['score'] = float(self.score)
@@ -383,9 +542,13 @@ class Source(Document):
     edition = StringField()
     source_person_author_surname = StringField()
     source_organization_author = StringField()
+    # referenced_by e reflinks: somente dos registros anteriores a
+    # SourceCitations, ver connections.migrate_citations
     referenced_by = ListField(StringField())
     ref_type = StringField()
     reflinks = EmbeddedDocumentListField(RefLink)
+    # ver get_source_fingerprint
+    fingerprint = StringField()
 
     # datas deste registro
     created = DateTimeField()
@@ -394,6 +557,7 @@ class Source(Document):
     meta = {
         'collection': 'rs_source',
         'indexes': [
+            {'fields': ['fingerprint'], 'unique': True, 'sparse': True},
             'pub_year',
             'vol',
             'num',
@@ -437,12 +601,7 @@ class Source(Document):
     def add_reflink(self, paper_id, pid, year, subject_areas):
         if not self.reflinks:
             self.reflinks = []
-        reflink = RefLink()
-        reflink.paper_id = str(paper_id)
-        reflink.pid = pid
-        reflink.year = int(year)
-        reflink.subject_areas = subject_areas
-        self.reflinks.append(reflink)
+        self.reflinks.append(create_reflink(paper_id, pid, year, subject_areas))
 
     def get_reflinks_tuples(self):
         return [reflink.as_tuple() for reflink in self.reflinks]
@@ -472,6 +631,10 @@ class Source(Document):
         if not self.created:
             self.created = utcnow()
         self.updated = utcnow()
+        self.normalize()
+        return super(Source, self).save(*args, **kwargs)
+
+    def normalize(self):
         self.doi = self.doi and self.doi.upper()
         self.to_upper('pub_year')
         self.to_upper('surname')
@@ -480,7 +643,12 @@ class Source(Document):
         self.to_upper('journal')
         self.to_upper('vol')
         self.ref_type = self.ref_type or self.get_ref_type()
-        return super(Source, self).save(*args, **kwargs)
+
+    def get_fingerprint(self):
+        return get_source_fingerprint(
+            self.doi, self.pub_year, self.surname, self.organization_author,
+            self.journal, self.source, self.vol,
+        )
 
 
 class Paper(Document):
@@ -563,7 +731,8 @@ class Paper(Document):
             return None
 
     def get_connections(self, min_score=None):
-        return list(self._get_connections())
+        return _add_connections_summaries(
+            list(self._get_connections(min_score)))
 
     def _get_connections(self, min_score=None):
         if min_score:
@@ -576,7 +745,8 @@ class Paper(Document):
 
     def add_connection(self, paper_id_to_connect_to, score=None):
         try:
-            paper = Paper.objects(pk=paper_id_to_connect_to)[0]
+            paper = Paper.objects(
+                pk=paper_id_to_connect_to).only('pid', 'pub_year')[0]
         except IndexError:
             raise exceptions.UnableToAddConnectionError(
                 "Unable to create paper connection because paper which "
@@ -584,7 +754,7 @@ class Paper(Document):
             )
         if not self.connections:
             self.connections = []
-        self.connections.append(_create_connection(paper, score))
+        self.connections.append(create_connection(paper, score))
 
     def add_uri(self, lang, value):
         if not self.uri:
@@ -718,6 +888,80 @@ class Paper(Document):
         return super(Paper, self).save(*args, **kwargs)
 
 
+class PaperEmbedding(Document):
+    """
+    Vetor (embedding) do texto de um paper gerado por um modelo.
+    `text_hash` identifica o texto que originou o vetor, se o texto do paper
+    mudar, o vetor deve ser gerado novamente
+    """
+    paper_id = StringField(required=True)
+    model_name = StringField(required=True)
+    text_hash = StringField(required=True)
+    # float32, float16 ou int8 (vector ~= valores int8 * scale)
+    dtype = StringField()
+    scale = FloatField()
+    vector = BinaryField()
+
+    # datas deste registro
+    created = DateTimeField()
+    updated = DateTimeField()
+
+    meta = {
+        'collection': 'rs_embedding',
+        'indexes': [
+            {'fields': ['paper_id', 'model_name'], 'unique': True},
+            ('model_name', 'updated'),
+        ]
+    }
+
+    def save(self, *args, **kwargs):
+        if not self.created:
+            self.created = utcnow()
+        self.updated = utcnow()
+        return super(PaperEmbedding, self).save(*args, **kwargs)
+
+
+class PaperSources(Document):
+    """
+    Índice de acoplamento bibliográfico: ids das fontes (`Source`) citadas
+    pelo paper. O inverso (fonte -> papers) é `SourceCitations`
+    """
+    paper_id = StringField(required=True, unique=True)
+    source_ids = ListField(StringField())
+
+    # datas deste registro
+    created = DateTimeField()
+    updated = DateTimeField()
+
+    meta = {
+        'collection': 'rs_paper_sources',
+    }
+
+
+class SourceCitations(Document):
+    """
+    Citações de uma fonte (`Source`) por papers publicados em um ano,
+    agrupadas em blocos de, no máximo, `configuration.CITATIONS_BUCKET_SIZE`
+    citações, para que os documentos tenham tamanho limitado
+    """
+    source_id = StringField(required=True)
+    # ano de publicação dos papers que citam a fonte
+    year = IntField(required=True)
+    count = IntField()
+    reflinks = EmbeddedDocumentListField(RefLink)
+
+    # datas deste registro
+    created = DateTimeField()
+    updated = DateTimeField()
+
+    meta = {
+        'collection': 'rs_source_citations',
+        'indexes': [
+            ('source_id', 'year', 'count'),
+        ]
+    }
+
+
 class Journal(Document):
     pid = StringField(max_length=9, unique=True, required=True)
     subject_areas = ListField(StringField())
@@ -102,6 +102,27 @@ def get_records(DataModelClass, **kwargs):
         **kwargs).order_by(order_by).skip(skip).limit(limit)
 
 
+def iter_records(DataModelClass, fields=None, batch_size=None, **kwargs):
+    """
+    Itera todos os registros que atendem `kwargs`, como `dict`,
+    sem paginação nem ordenação, usando o cursor do servidor
+    com lotes de `batch_size` registros
+
+    Parameters
+    ----------
+    DataModelClass: Document
+    fields: str list
+        campos obtidos (projeção), aceita campos de documentos embutidos,
+        por exemplo, `reflinks.paper_id`
+    batch_size: int
+        quantidade de registros por lote (padrão: 1000)
+    """
+    query_set = DataModelClass.objects(**kwargs)
+    if fields:
+        query_set = query_set.only(*fields)
+    return query_set.no_cache().as_pymongo().batch_size(batch_size or 1000)
+
+
 # def get_query_set_with_or(field_names, values):
 #     qs = None
 #     for name, value in zip(field_names, values):
@@ -133,3 +133,5 @@ class BadPaperURIFormatError(Exception):
     ...
 
 
+class UnknownModelError(Exception):
+    ...
@@ -0,0 +1,118 @@
+import argparse
+import json
+import time
+
+from xlingual_papers_recommender.core import (
+    semantics, quantization, inference_backends,
+)
+from xlingual_papers_recommender.utils import files_utils
+
+
+def _top_k_agreement(vectors, baseline, k=10, n_queries=100):
+    """
+    Proporção média dos `k` mais similares (obtidos com `baseline`)
+    que também são obtidos com `vectors`, usando os próprios textos
+    como consulta
+    """
+    n_queries = min(n_queries, len(vectors))
+    found = 0
+    for i in range(n_queries):
+        expected = set(quantization.top_k(
+            quantization.dot_scores(baseline[i], baseline), k))
+        got = set(quantization.top_k(
+            quantization.dot_scores(vectors[i], vectors), k))
+        found += len(expected & got) / len(expected)
+    return found / n_queries
+
+
+def benchmark_backends(texts, model_name=None, backends=None,
+                       batch_size=None):
+    """
+    Mede sentenças por segundo de cada backend de inferência e compara
+    os vetores e os scores obtidos com os do backend torch
+
+    Returns
+    -------
+    list
+        dict keys: backend, sentences_per_second, load_seconds, rss_delta_mb,
+        mean_cosine_to_torch, min_cosine_to_torch, top_10_agreement
+    """
+    model_name = semantics.get_model_name(model_name)
+    batch_size = batch_size or 32
+    backends = [
+        b for b in (backends or inference_backends.BACKENDS) if b != "torch"
+    ]
+
+    results = []
+    baseline = None
+    for backend in ["torch"] + backends:
+        holder = semantics.ModelHolder(model_name, backend)
+        model = holder.get()
+        # aquecimento
+        model.encode(texts[:batch_size], batch_size=batch_size)
+
+        start = time.time()
+        vectors = semantics.normalize(model.encode(
+            texts, batch_size=batch_size, convert_to_numpy=True))
+        seconds = time.time() - start
+
+        result = {
+            "backend": backend,
+            "sentences": len(texts),
+            "sentences_per_second": len(texts) / seconds,
+            "load_seconds": holder.load_seconds,
+            "rss_delta_mb": holder.rss_delta_mb,
+        }
+        if baseline is None:
+            baseline = vectors
+        else:
+            cosines = (vectors * baseline).sum(axis=1)
+            result["mean_cosine_to_torch"] = float(cosines.mean())
+            result["min_cosine_to_torch"] = float(cosines.min())
+            result["top_10_agreement"] = _top_k_agreement(vectors, baseline)
+        print(result)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the inference backends")
+    parser.add_argument(
+        "texts_file_path",
+        help=(
+            "/path/texts.txt (one text for each row)"
+        )
+    )
+    parser.add_argument(
+        "--model_name",
+        help=(
+            "sentence-transformer model name. Default: DEFAULT_MODEL"
+        )
+    )
+    parser.add_argument(
+        "--backends",
+        help=(
+            "comma separated backends. Default: torch,torch_int8,onnx"
+        )
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help=(
+            "number of texts for each call to the model. Default: 32"
+        )
+    )
+    args = parser.parse_args()
+
+    texts = [
+        row for row in files_utils.read_file_rows(args.texts_file_path) if row
+    ]
+    backends = args.backends and args.backends.split(",")
+    results = benchmark_backends(
+        texts, args.model_name, backends, args.batch_size)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
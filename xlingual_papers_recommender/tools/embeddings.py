@@ -0,0 +1,194 @@
+import argparse
+import json
+
+import numpy as np
+
+from xlingual_papers_recommender.configuration import SEARCH_PAPERS_MODEL
+from xlingual_papers_recommender.db.data_models import Paper
+from xlingual_papers_recommender.core import (
+    connections, embeddings, quantization, semantics, vector_index,
+)
+from xlingual_papers_recommender.utils import files_utils
+
+
+def get_papers(items_per_page):
+    """
+    Itera os papers em páginas, obtendo somente os campos dos textos
+    """
+    page = 0
+    while True:
+        page += 1
+        skip = ((page - 1) * items_per_page)
+        items = Paper.objects().only(
+            'paper_titles', 'abstracts', 'keywords',
+        ).order_by('id').skip(skip).limit(items_per_page)
+        items = list(items)
+        if not items:
+            break
+        yield items
+
+
+def embed_papers(output_file_path, model_name=None, force_update=False,
+                 batch_size=None, items_per_page=None):
+    """
+    Gera e armazena os vetores de todos os papers registrados.
+    Cada página de papers é processada agrupando os textos por quantidade de
+    tokens, quanto maior a página, menor o preenchimento (padding) dos lotes
+    """
+    files_utils.write_file(output_file_path, "")
+    for papers in get_papers(items_per_page or 1000):
+        paper_ids = []
+        texts = []
+        for paper in papers:
+            text = connections.get_text_for_semantic_search(paper)
+            if text:
+                paper_ids.append(paper._id)
+                texts.append(text)
+        try:
+            response = embeddings.embed_papers(
+                paper_ids, texts, model_name, force_update, batch_size)
+        except Exception as e:
+            response = {"exception": str(type(e)), "msg": str(e)}
+        response["first"] = papers[0]._id
+        response["last"] = papers[-1]._id
+        print(response)
+        files_utils.write_file(
+            output_file_path, json.dumps(response) + "\n", "a")
+
+
+def check_recall(model_name=None, max_vectors=None, k=None, n_queries=None):
+    """
+    Compara os k mais similares obtidos com os vetores float16 e int8 com os
+    obtidos com os vetores float32 (recall@k), usando os vetores armazenados
+    """
+    model_name = semantics.get_model_name(model_name)
+    vectors = []
+    for paper_id, vector, mark in embeddings.get_store().iter_updates(
+            model_name):
+        vectors.append(vector)
+        if len(vectors) == (max_vectors or 10000):
+            break
+    if not vectors:
+        return {"model_name": model_name, "vectors": 0}
+    vectors = np.vstack(vectors)
+    response = {"model_name": model_name, "vectors": len(vectors)}
+    for dtype in quantization.DTYPES:
+        response["recall_%s" % dtype] = quantization.recall_at_k(
+            vectors, dtype, k or 10, n_queries or 100)
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Papers embeddings")
+    subparsers = parser.add_subparsers(
+        title="Commands", metavar="", dest="command",
+    )
+
+    embed_papers_parser = subparsers.add_parser(
+        "embed_papers",
+        help=(
+            "Generate and store the embeddings of the registered papers"
+        )
+    )
+    embed_papers_parser.add_argument(
+        "--model_name",
+        help=(
+            "sentence-transformer model name. Default: DEFAULT_MODEL"
+        )
+    )
+    embed_papers_parser.add_argument(
+        "--force_update",
+        type=bool,
+        default=False,
+        help=(
+            "True to generate the embeddings even if they are already stored"
+        )
+    )
+    embed_papers_parser.add_argument(
+        "--batch_size",
+        type=int,
+        help=(
+            "number of texts for each call to the model"
+        )
+    )
+    embed_papers_parser.add_argument(
+        "--items_per_page",
+        type=int,
+        help=(
+            "number of papers sorted by number of tokens at once. Default: 1000"
+        )
+    )
+    embed_papers_parser.add_argument(
+        "output_file_path",
+        help=(
+            "/path/embeddings.jsonl"
+        )
+    )
+
+    check_recall_parser = subparsers.add_parser(
+        "check_recall",
+        help=(
+            "Compare the top k similar papers found using float16 / int8 "
+            "vectors with the ones found using float32 vectors"
+        )
+    )
+    check_recall_parser.add_argument(
+        "--model_name",
+        help=(
+            "sentence-transformer model name. Default: DEFAULT_MODEL"
+        )
+    )
+    check_recall_parser.add_argument(
+        "--max_vectors",
+        type=int,
+        help=(
+            "number of stored vectors used. Default: 10000"
+        )
+    )
+    check_recall_parser.add_argument(
+        "--k",
+        type=int,
+        help=(
+            "number of similar papers. Default: 10"
+        )
+    )
+    check_recall_parser.add_argument(
+        "--n_queries",
+        type=int,
+        help=(
+            "number of queries. Default: 100"
+        )
+    )
+
+    build_index_parser = subparsers.add_parser(
+        "build_index",
+        help=(
+            "Build the vector index (IVF-flat) used by search_papers "
+            "from the stored embeddings"
+        )
+    )
+    build_index_parser.add_argument(
+        "--model_name",
+        help=(
+            "sentence-transformer model name. Default: SEARCH_PAPERS_MODEL"
+        )
+    )
+
+    args = parser.parse_args()
+    if args.command == "embed_papers":
+        embed_papers(
+            args.output_file_path, args.model_name, args.force_update,
+            args.batch_size, args.items_per_page,
+        )
+    elif args.command == "check_recall":
+        print(json.dumps(check_recall(
+            args.model_name, args.max_vectors, args.k, args.n_queries)))
+    elif args.command == "build_index":
+        print(json.dumps(vector_index.build_index(
+            args.model_name or SEARCH_PAPERS_MODEL)))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
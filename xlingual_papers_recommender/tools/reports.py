@@ -1,7 +1,9 @@
 import argparse
 import csv
 
-from xlingual_papers_recommender.db.data_models import Source, Paper
+from xlingual_papers_recommender.db.data_models import (
+    Source, Paper, SourceCitations,
+)
 from xlingual_papers_recommender.db import db
 
 
@@ -164,8 +166,21 @@ def create_connections_csv(output_csv_file_path):
                 writer.writerow(data)
 
 
+def _get_reflinks(source):
+    """
+    Citações da fonte registradas em rs_source_citations e, se ainda não
+    migradas, em `Source.reflinks`
+    """
+    reflinks = list(source.reflinks or [])
+    for bucket in SourceCitations.objects(source_id=source._id).only('reflinks'):
+        reflinks.extend(bucket.reflinks)
+    return reflinks
+
+
 def _eval_reflinks_years(reflinks):
     years = [r.year for r in reflinks]
+    if not years:
+        return {}
     return {
         'reflinks_year_min': min(years),
         'reflinks_year_max': max(years),
@@ -189,8 +204,9 @@ def create_source_csv(output_csv_file_path):
             data['doi'] = 1 if item.doi else 0
             data['ref_type'] = item.ref_type
             data['pub_year'] = item.pub_year
-            data['reflinks'] = len(item.reflinks)
-            data.update(_eval_reflinks_years(item.reflinks))
+            reflinks = _get_reflinks(item)
+            data['reflinks'] = len(reflinks)
+            data.update(_eval_reflinks_years(reflinks))
             writer.writerow(data)
 
 
@@ -205,13 +221,14 @@ def create_source_refs_csv(output_csv_file_path):
 
         writer.writeheader()
         for item in get_records(Source):
-            for ref in item.reflinks:
+            reflinks = _get_reflinks(item)
+            for ref in reflinks:
                 data = {}
                 data['source_id'] = item._id
                 data['doi'] = 1 if item.doi else 0
                 data['ref_type'] = item.ref_type
                 data['pub_year'] = item.pub_year
-                data['reflinks'] = len(item.reflinks)
+                data['reflinks'] = len(reflinks)
                 data['pid'] = ref.pid
                 writer.writerow(data)
 
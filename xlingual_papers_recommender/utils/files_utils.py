@@ -1,7 +1,8 @@
 
 import os
 import csv
-# import numpy as np
+
+import numpy as np
 
 
 def create_folder(*args):
@@ -0,0 +1,49 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Cache em memória (de cada processo) dos `max_size` itens usados mais
+    recentemente. Cada item é válido por `ttl` segundos (0 = sem limite)
+    """
+
+    def __init__(self, max_size, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._items[key]
+            except KeyError:
+                return default
+            if expires and expires < time.time():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if not self.max_size:
+            return
+        expires = self.ttl and time.time() + self.ttl
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
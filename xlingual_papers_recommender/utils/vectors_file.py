@@ -0,0 +1,334 @@
+"""
+Matriz de vetores append-only em disco, lida por memory map.
+
+Os arquivos são compartilhados (somente leitura) pelos processos de um mesmo
+host, assim o cache de páginas do sistema operacional serve os vetores mais
+usados a todos os workers sem cópias, e a memória de cada worker não cresce
+com o tamanho do corpus.
+
+folder/
+    meta.json     {"dim": 768, "dtype": "float32"}
+    vectors.bin   uma linha de `dim` valores `dtype` por vetor
+    scales.bin    uma escala float32 por vetor (somente para int8)
+    ids.bin       id e text_hash de cada linha (registros de tamanho fixo)
+    sorted.bin    ids das linhas [0, n) ordenados e as linhas correspondentes
+                  (n ids de ID_SIZE bytes seguidos de n linhas int64),
+                  para a busca binária; refeito pela escrita quando as
+                  linhas acrescentadas depois dele excedem MAX_UNSORTED_ROWS
+    .lock         trava para as escritas (append)
+
+A última ocorrência de um id prevalece. Cada processo mantém em memória
+somente as linhas acrescentadas depois de sorted.bin.
+"""
+import os
+import json
+import fcntl
+
+import numpy as np
+
+
+ID_SIZE = 32
+TEXT_HASH_SIZE = 40
+MAX_UNSORTED_ROWS = 10000
+
+_ROW_DTYPE = np.dtype([
+    ('id', 'S%i' % ID_SIZE),
+    ('text_hash', 'S%i' % TEXT_HASH_SIZE),
+])
+_SORTED_ENTRY_SIZE = ID_SIZE + 8
+
+
+def _encode_id(_id):
+    value = str(_id).encode("utf-8")
+    if len(value) > ID_SIZE:
+        raise ValueError("id longer than %i bytes: %s" % (ID_SIZE, _id))
+    return value
+
+
+class VectorsFile:
+
+    def __init__(self, folder, dtype="float32"):
+        self.folder = folder
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+
+        self._vectors_path = os.path.join(folder, "vectors.bin")
+        self._scales_path = os.path.join(folder, "scales.bin")
+        self._ids_path = os.path.join(folder, "ids.bin")
+        self._sorted_path = os.path.join(folder, "sorted.bin")
+        self._meta_path = os.path.join(folder, "meta.json")
+        self._lock_path = os.path.join(folder, ".lock")
+
+        self._rows = 0
+        self._matrix = None
+        self._scales = None
+        self._records = None
+        # ids ordenados e linhas de sorted.bin (memory map)
+        self._sorted_stat = None
+        self._sorted_ids = np.empty(0, dtype=_ROW_DTYPE['id'])
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+        # id -> linha, somente das linhas que não estão em sorted.bin
+        self._unsorted = {}
+        self._read_meta()
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_path) as fp:
+                meta = json.load(fp)
+        except IOError:
+            return
+        # o arquivo existente define o formato
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+
+    def _write_meta(self, dim):
+        self.dim = dim
+        with open(self._meta_path, "w") as fp:
+            json.dump({"dim": dim, "dtype": self.dtype.name}, fp)
+
+    @property
+    def row_size(self):
+        return self.dim * self.dtype.itemsize
+
+    @property
+    def has_scales(self):
+        return self.dtype == np.int8
+
+    def _count_rows(self):
+        try:
+            rows = min(
+                os.path.getsize(self._vectors_path) // self.row_size,
+                os.path.getsize(self._ids_path) // _ROW_DTYPE.itemsize,
+            )
+        except OSError:
+            return 0
+        if self.has_scales:
+            try:
+                rows = min(rows, os.path.getsize(self._scales_path) // 4)
+            except OSError:
+                return 0
+        return rows
+
+    def _read_sorted(self):
+        """
+        Abre novamente sorted.bin, se foi refeito por outro processo
+        """
+        try:
+            stat = os.stat(self._sorted_path)
+        except OSError:
+            return False
+        stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if stat == self._sorted_stat:
+            return False
+        n = stat[1] // _SORTED_ENTRY_SIZE
+        if n:
+            self._sorted_ids = np.memmap(
+                self._sorted_path, dtype=_ROW_DTYPE['id'], mode="r",
+                shape=(n, ),
+            )
+            self._sorted_rows = np.memmap(
+                self._sorted_path, dtype=np.int64, mode="r",
+                offset=n * ID_SIZE, shape=(n, ),
+            )
+        self._sorted_stat = stat
+        return True
+
+    def refresh(self):
+        """
+        Incorpora os vetores acrescentados por outros processos
+        """
+        if self.dim is None:
+            self._read_meta()
+            if self.dim is None:
+                return
+        sorted_changed = self._read_sorted()
+        rows = self._count_rows()
+        if rows and (self._matrix is None or self._rows < rows):
+            self._matrix = np.memmap(
+                self._vectors_path, dtype=self.dtype, mode="r",
+                shape=(rows, self.dim),
+            )
+            if self.has_scales:
+                self._scales = np.memmap(
+                    self._scales_path, dtype=np.float32, mode="r",
+                    shape=(rows, ),
+                )
+            self._records = np.memmap(
+                self._ids_path, dtype=_ROW_DTYPE, mode="r", shape=(rows, ),
+            )
+        if sorted_changed or rows > self._rows:
+            self._rows = rows
+            self._read_unsorted()
+
+    def _read_unsorted(self):
+        first_row = len(self._sorted_ids)
+        if self._records is None:
+            return
+        if first_row > self._rows:
+            # sorted.bin é mais recente que a contagem das linhas
+            first_row = self._rows
+        self._unsorted = {
+            _id: first_row + i
+            for i, _id in enumerate(self._records['id'][first_row:self._rows])
+        }
+
+    def _find_rows(self, keys):
+        """
+        Linha vigente de cada id (`keys`, bytes) ou -1
+        """
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(self._sorted_ids) and len(keys):
+            keys_array = np.array(keys, dtype=_ROW_DTYPE['id'])
+            # a última ocorrência de cada id (ordenados por id, linha)
+            positions = np.searchsorted(
+                self._sorted_ids, keys_array, side="right") - 1
+            found = positions >= 0
+            found[found] = (
+                self._sorted_ids[positions[found]] == keys_array[found])
+            rows[found] = self._sorted_rows[positions[found]]
+        for i, key in enumerate(keys):
+            rows[i] = self._unsorted.get(key, rows[i])
+        return rows
+
+    @property
+    def matrix(self):
+        self.refresh()
+        return self._matrix
+
+    @property
+    def scales(self):
+        self.refresh()
+        return self._scales
+
+    def __len__(self):
+        """
+        Quantidade de linhas gravadas, inclusive as substituídas
+        por um vetor mais novo do mesmo id
+        """
+        self.refresh()
+        return self._rows
+
+    def get(self, ids):
+        """
+        Returns
+        -------
+        dict
+            key: id, value: (text_hash, numpy.ndarray, escala ou None)
+        """
+        self.refresh()
+        ids = [_id for _id in ids if len(str(_id).encode("utf-8")) <= ID_SIZE]
+        items = {}
+        if self._records is None:
+            return items
+        rows = self._find_rows([_encode_id(_id) for _id in ids])
+        for _id, row in zip(ids, rows):
+            if row < 0 or row >= self._rows:
+                continue
+            text_hash = self._records[row]['text_hash'].decode("utf-8")
+            scale = self._scales[row] if self.has_scales else None
+            items[_id] = (text_hash, self._matrix[row], scale)
+        return items
+
+    def items(self):
+        """
+        Itera (id, text_hash, row) dos vetores vigentes
+        """
+        self.refresh()
+        if self._records is None:
+            return
+        n = min(len(self._sorted_ids), self._rows)
+        chunk_size = 100000
+        for start in range(0, n, chunk_size):
+            end = min(n, start + chunk_size)
+            # um id a mais para saber se o último do bloco se repete
+            ids = np.asarray(self._sorted_ids[start:min(n, end + 1)])
+            last = np.ones(end - start, dtype=bool)
+            last[:len(ids) - 1] = ids[:-1] != ids[1:]
+            for i in np.flatnonzero(last):
+                if ids[i] in self._unsorted:
+                    continue
+                yield self._get_item(int(self._sorted_rows[start + i]))
+        for row in sorted(self._unsorted.values()):
+            yield self._get_item(row)
+
+    def _get_item(self, row):
+        record = self._records[row]
+        return (
+            record['id'].decode("utf-8"),
+            record['text_hash'].decode("utf-8"),
+            row,
+        )
+
+    def append(self, ids, text_hashes, vectors, scales=None):
+        """
+        Acrescenta os vetores, já no formato `dtype`
+        (e suas escalas, se `dtype` é int8)
+        """
+        vectors = np.asarray(vectors)
+        if not len(vectors):
+            return
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+        with open(self._lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                ids = list(ids)
+                for _id in ids:
+                    _encode_id(_id)
+                self._read_meta()
+                if self.has_scales and scales is None:
+                    raise ValueError("int8 vectors require scales")
+                if self.dim is None:
+                    self._write_meta(vectors.shape[1])
+                vectors = vectors.astype(self.dtype, copy=False)
+
+                first_row = self._count_rows()
+                if self.has_scales:
+                    self._write(
+                        self._scales_path, first_row * 4,
+                        np.asarray(scales, dtype=np.float32))
+                self._write(
+                    self._vectors_path, first_row * self.row_size, vectors)
+
+                records = np.array(
+                    [(_encode_id(_id), text_hash.encode("utf-8"))
+                     for _id, text_hash in zip(ids, text_hashes)],
+                    dtype=_ROW_DTYPE,
+                )
+                self._write(
+                    self._ids_path, first_row * _ROW_DTYPE.itemsize, records)
+                self._sort(first_row + len(records))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, file_path, size, values):
+        with open(file_path, "ab") as fp:
+            # despreza escrita incompleta anterior
+            fp.truncate(size)
+            fp.write(values.tobytes())
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def _sort(self, rows):
+        """
+        Refaz sorted.bin com todas as linhas, se as linhas acrescentadas
+        depois dele excedem MAX_UNSORTED_ROWS (executado com a trava)
+        """
+        try:
+            sorted_rows = os.path.getsize(self._sorted_path) // _SORTED_ENTRY_SIZE
+        except OSError:
+            sorted_rows = 0
+        if rows - sorted_rows <= MAX_UNSORTED_ROWS:
+            return
+        ids = np.fromfile(self._ids_path, dtype=_ROW_DTYPE, count=rows)['id']
+        # estável: as ocorrências de um id ficam em ordem de linha
+        order = np.argsort(ids, kind="stable")
+        tmp_path = self._sorted_path + ".tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(ids[order].tobytes())
+            fp.write(order.astype(np.int64).tobytes())
+            fp.flush()
+            os.fsync(fp.fileno())
+        # os processos que leem o arquivo anterior continuam com ele aberto
+        os.replace(tmp_path, self._sorted_path)